@@ -0,0 +1,94 @@
+"""
+Benchmark and check of sharded scanning (`moneriote.distributed`) over loopback.
+
+Starts `--workers` scan worker processes (`moneriote --worker`), builds the fake
+node farm of `bench_prefilter.py` and scans it once locally and once sharded
+over the workers. Prints the time taken by each run and fails when the results
+differ.
+
+    python benchmarks/bench_distributed.py --workers 2 --open 20 --closed 2000 --filtered 200
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import click
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from bench_prefilter import HEIGHT, build_farm, free_port
+from moneriote import CONFIG
+from moneriote.distributed import scan_distributed
+from moneriote.rpc import RpcNode, iter_scan
+
+
+def start_workers(amount: int, probe_timeout: float, concurrent_scans: int):
+    """:return: list of (address, process)"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    workers = []
+    for _ in range(amount):
+        address = '127.0.0.1:%d' % free_port()
+        process = subprocess.Popen([sys.executable, '-c', 'from moneriote.main import cli; cli()',
+                                    '--worker', address, '--log-level', 'warning',
+                                    '--probe-timeout', str(probe_timeout),
+                                    '--concurrent_scans', str(concurrent_scans)], env=env)
+        workers.append((address, process))
+
+    for address, _ in workers:
+        host, port = address.split(':')
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                socket.create_connection((host, int(port)), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError('worker %s did not start' % address)
+                time.sleep(0.1)
+    return workers
+
+
+def results(nodes):
+    return sorted((node.netloc, node.valid) for node in nodes)
+
+
+@click.command()
+@click.option('--workers', default=2, show_default=True, help='Amount of worker processes.')
+@click.option('--open', 'open_nodes', default=20, show_default=True, help='Amount of valid fake nodes.')
+@click.option('--closed', default=2000, show_default=True, help='Amount of nodes refusing connections.')
+@click.option('--filtered', default=200, show_default=True, help='Amount of nodes dropping connects.')
+@click.option('--concurrent-scans', default=20, show_default=True, help='Processes of the HTTP check, per worker.')
+@click.option('--probe-timeout', default=1.0, show_default=True, help='Timeout of the HTTP check.')
+def main(workers, open_nodes, closed, filtered, concurrent_scans, probe_timeout):
+    CONFIG.update(probe_timeout=probe_timeout, tcp_prefilter=True, tcp_timeout=0, tcp_max_in_flight=500,
+                  concurrent_scans=concurrent_scans)
+    farm, keep = build_farm(open_nodes, closed, filtered)
+    print('farm: %d open, %d closed, %d filtered; %d worker(s)' % (open_nodes, closed, filtered, workers))
+
+    processes = start_workers(workers, probe_timeout, concurrent_scans)
+    try:
+        start = time.monotonic()
+        local = list(iter_scan([RpcNode(address, port=port) for address, port in farm], HEIGHT, concurrent_scans))
+        local_seconds = time.monotonic() - start
+
+        start = time.monotonic()
+        sharded = scan_distributed([RpcNode(address, port=port) for address, port in farm], HEIGHT,
+                                   [address for address, _ in processes])
+        sharded_seconds = time.monotonic() - start
+    finally:
+        for _, process in processes:
+            process.terminate()
+            process.wait()
+
+    for name, seconds, nodes in (('local', local_seconds, local), ('sharded', sharded_seconds, sharded)):
+        print('%-8s %6.1fs  %d/%d valid' % (name, seconds, len([node for node in nodes if node.valid]), len(nodes)))
+
+    if results(local) != results(sharded):
+        raise SystemExit('results of the local and the sharded scan differ')
+
+
+if __name__ == '__main__':
+    main()
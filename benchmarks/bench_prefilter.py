@@ -0,0 +1,117 @@
+"""
+Benchmark of the TCP connect pre-filter (`moneriote.prefilter`) against a farm
+of fake nodes on the loopback interface:
+
+- open: HTTP servers answering `/getheight` like a synced node
+- closed: addresses without a listener, the connect is refused
+- filtered: addresses of a listener with a full backlog, the connect hangs
+  like it would behind a firewall dropping SYNs (Linux)
+
+Scans the farm with `iter_scan` with and without the pre-filter and prints the
+time taken and the amount of valid nodes of each run.
+
+    python benchmarks/bench_prefilter.py --open 20 --closed 2000 --filtered 200
+"""
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from moneriote import CONFIG
+from moneriote.rpc import RpcNode, iter_scan
+
+HEIGHT = 1000000
+
+
+class FakeNodeHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps({'height': HEIGHT, 'status': 'OK'}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeNodeServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def build_farm(open_nodes: int, closed: int, filtered: int):
+    """:return: (nodes, resources to keep alive while scanning)"""
+    nodes, keep = [], []
+
+    for _ in range(open_nodes):
+        server = FakeNodeServer(('127.0.0.1', 0), FakeNodeHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        keep.append(server)
+        nodes.append(('127.0.0.1', server.server_address[1]))
+
+    port = free_port()
+    for i in range(closed):
+        nodes.append(('127.1.%d.%d' % (i // 250, i % 250 + 1), port))
+
+    if filtered:
+        # a listener that never accepts; once its backlog is full further SYNs are dropped
+        listener = socket.socket()
+        listener.bind(('0.0.0.0', 0))
+        listener.listen(0)
+        keep.append(listener)
+        port = listener.getsockname()[1]
+        for _ in range(4):
+            sock = socket.socket()
+            sock.setblocking(False)
+            sock.connect_ex(('127.0.0.1', port))
+            keep.append(sock)
+        time.sleep(0.2)
+        for i in range(filtered):
+            nodes.append(('127.2.%d.%d' % (i // 250, i % 250 + 1), port))
+
+    return nodes, keep
+
+
+def run(nodes, prefilter: bool, processes: int):
+    CONFIG['tcp_prefilter'] = prefilter
+    start = time.monotonic()
+    results = list(iter_scan([RpcNode(address, port=port) for address, port in nodes], HEIGHT, processes))
+    return time.monotonic() - start, len([node for node in results if node.valid]), len(results)
+
+
+@click.command()
+@click.option('--open', 'open_nodes', default=20, show_default=True, help='Amount of valid fake nodes.')
+@click.option('--closed', default=2000, show_default=True, help='Amount of nodes refusing connections.')
+@click.option('--filtered', default=200, show_default=True, help='Amount of nodes dropping connects.')
+@click.option('--concurrent-scans', default=20, show_default=True, help='Processes of the HTTP check.')
+@click.option('--probe-timeout', default=1.0, show_default=True, help='Timeout of the HTTP check.')
+@click.option('--tcp-max-in-flight', default=500, show_default=True, help='Concurrent connects of the pre-filter.')
+def main(open_nodes, closed, filtered, concurrent_scans, probe_timeout, tcp_max_in_flight):
+    CONFIG.update(probe_timeout=probe_timeout, tcp_timeout=0, tcp_max_in_flight=tcp_max_in_flight)
+    nodes, keep = build_farm(open_nodes, closed, filtered)
+    print('farm: %d open, %d closed, %d filtered' % (open_nodes, closed, filtered))
+
+    for prefilter in (False, True):
+        seconds, valid, total = run(nodes, prefilter, concurrent_scans)
+        print('%-16s %6.1fs  %d/%d valid' % ('pre-filter' if prefilter else 'no pre-filter', seconds, valid, total))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,8 @@
 import os
 import tempfile
-from multiprocessing import freeze_support
-
-freeze_support()
 
 PATH_CACHE = os.path.join(tempfile.gettempdir(), 'moneriote-cache.json')
+PATH_NEGATIVE_CACHE = os.path.join(tempfile.gettempdir(), 'moneriote-negative-cache.json')
+PATH_STATE = os.path.join(tempfile.gettempdir(), 'moneriote-state.json')
+PATH_PROFILES = os.path.join(tempfile.gettempdir(), 'moneriote-profiles')
 CONFIG = {}
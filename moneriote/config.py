@@ -0,0 +1,210 @@
+"""
+Configuration; maps the CLI options and the ini file (`--from-config`) onto
+`CONFIG`, and reloads the ini file and ban list while running, when either
+changes on disk or on SIGHUP.
+"""
+import os
+import signal
+import time
+
+from moneriote import CONFIG
+from moneriote.utils import log_msg, log_err, parse_ini
+
+
+def _bool(value):
+    return value is True or str(value).lower() == 'true'
+
+
+# cli option: (ini section, ini key, cast)
+INI_OPTIONS = {
+    'monerod_path': ('MoneroDaemon', 'path', str),
+    'monerod_address': ('MoneroDaemon', 'address', str),
+    'monerod_port': ('MoneroDaemon', 'port', int),
+    'monerod_auth': ('MoneroDaemon', 'auth', str),
+    'blockheight_discovery': ('MoneroDaemon', 'height_discovery_method', str),
+    'dns_provider': ('DNS', 'provider', str),
+    'domain': ('DNS', 'domain_name', str),
+    'subdomain': ('DNS', 'subdomain_name', str),
+    'api_key': ('DNS', 'api_key', str),
+    'api_email': ('DNS', 'api_email', str),
+    'max_records': ('DNS', 'max_records', int),
+    'max_records_aaaa': ('DNS', 'max_records_aaaa', int),
+    'selection': ('DNS', 'selection', str),
+    'max_rotations': ('DNS', 'max_rotations', int),
+    'rotation_factor': ('DNS', 'rotation_factor', float),
+    'rotation_min_gap': ('DNS', 'rotation_min_gap', float),
+    'ban_list': ('BanList', 'ban_list_path', str),
+    'concurrent_scans': ('Scan', 'concurrent_scans', int),
+    'scan_interval': ('Scan', 'scan_interval', int),
+    'loop_interval': ('Scan', 'loop_interval', int),
+    'rpc_port': ('Scan', 'rpc_port', int),
+    'probe_timeout': ('Scan', 'probe_timeout', float),
+    'block_offset': ('Scan', 'block_offset', int),
+    'height_timeout': ('Scan', 'height_timeout', float),
+    'height_retries': ('Scan', 'height_retries', int),
+    'adaptive_timeout': ('Scan', 'adaptive_timeout', _bool),
+    'adaptive_percentile': ('Scan', 'adaptive_percentile', float),
+    'adaptive_margin': ('Scan', 'adaptive_margin', float),
+}
+
+# changing any of these requires a new DNS provider instance
+PROVIDER_OPTIONS = ('dns_provider', 'domain', 'subdomain', 'api_key', 'api_email', 'dns_rate_limit',
+                    'dns_concurrency')
+
+
+def apply_ini(options: dict, path: str):
+    """:return: copy of `options` with the values of the ini file at `path` applied on top"""
+    if not os.path.isfile(path):
+        raise ValueError('%s missing' % path)
+
+    sections = dict(zip(('MoneroDaemon', 'DNS', 'BanList', 'Scan'), parse_ini(path)))
+    options = dict(options)
+    for name, (section, key, cast) in INI_OPTIONS.items():
+        if key in sections[section]:
+            options[name] = cast(sections[section][key])
+    return options
+
+
+def _split(value):
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+def build_config(options: dict):
+    """:return: the `CONFIG` values for `options`; raises ValueError on bad values"""
+    from moneriote.negative_cache import parse_ttls
+
+    if options['blockheight_discovery'] not in ['xmrchain', 'monerod', 'compare', 'moneroblocks']:
+        raise ValueError('bad height_discovery_method option')
+
+    return {
+        'concurrent_scans': options['concurrent_scans'],
+        'scan_interval': options['scan_interval'],
+        'loop_interval': options['loop_interval'],
+        'ipv6': options['max_records_aaaa'] > 0,
+        'rpc_port': options['rpc_port'],
+        'probe_timeout': options['probe_timeout'],
+        'block_offset': options['block_offset'],
+        'height_timeout': options['height_timeout'],
+        'height_retries': options['height_retries'],
+        'adaptive_timeout': options['adaptive_timeout'],
+        'adaptive_percentile': options['adaptive_percentile'],
+        'adaptive_margin': options['adaptive_margin'],
+        'tcp_prefilter': options['tcp_prefilter'],
+        'tcp_timeout': options['tcp_timeout'],
+        'tcp_max_in_flight': options['tcp_max_in_flight'],
+        'selection': options['selection'],
+        'max_rotations': options['max_rotations'],
+        'rotation_factor': options['rotation_factor'],
+        'rotation_min_gap': options['rotation_min_gap'],
+        'negative_cache_size': options['negative_cache_size'],
+        'negative_cache_ttls': parse_ttls(options['negative_cache_ttl']),
+        'workers': _split(options['workers']),
+        'peer_daemons': _split(options['peer_daemons']),
+        'peer_public_nodes': options['peer_public_nodes']
+    }
+
+
+def build_provider(options: dict):
+    """:return: a `DnsProvider` for `options`; raises ValueError on bad values"""
+    from moneriote.dns import load_provider
+
+    for name in ('api_email', 'api_key', 'domain'):
+        if not options[name]:
+            raise ValueError('Parameter %s is required' % name)
+
+    provider_cls = load_provider(options['dns_provider'])
+    if not provider_cls:
+        raise ValueError("Unknown DNS provider \'%s\'" % options['dns_provider'])
+    return provider_cls(
+        domain_name=options['domain'],
+        subdomain_name=options['subdomain'],
+        api_key=options['api_key'],
+        api_email=options['api_email'],
+        max_records=options['max_records'],
+        max_records_aaaa=options['max_records_aaaa'],
+        rate_limit=options['dns_rate_limit'],
+        concurrency=options['dns_concurrency'])
+
+
+class ConfigWatcher:
+    def __init__(self, mon, cli_options: dict, options: dict):
+        """
+        :param mon: the running `Moneriote` instance
+        :param cli_options: options as given on the command line; the ini file is applied on top
+        :param options: the options currently in effect
+        """
+        self.mon = mon
+        self.cli_options = cli_options
+        self.options = options
+        self._reload_requested = False
+        self._mtimes = self._stat()
+
+    def install_signal_handler(self):
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._on_sighup)
+
+    def _on_sighup(self, signum, frame):
+        self._reload_requested = True
+
+    def _stat(self):
+        mtimes = {}
+        for path in (self.cli_options['from_config'], self.options['ban_list']):
+            if path:
+                try:
+                    mtimes[path] = os.stat(path).st_mtime
+                except OSError:
+                    mtimes[path] = None
+        return mtimes
+
+    def check(self):
+        """Reloads when requested via SIGHUP or when the ini file or ban list changed"""
+        if self._reload_requested or self._stat() != self._mtimes:
+            self._reload_requested = False
+            self.reload()
+
+    def reload(self):
+        """
+        Re-reads the ini file and ban list. Everything is loaded and validated first and
+        only then swapped in; on any error the current configuration is kept.
+        """
+        log_msg('Reloading configuration')
+        try:
+            options = dict(self.cli_options)
+            if self.cli_options['from_config']:
+                options = apply_ini(options, self.cli_options['from_config'])
+            config = build_config(options)
+            ban_list = self.mon.load_ban_list(options['ban_list'])
+
+            provider = self.mon.dns_provider
+            if provider is not None and any(options[name] != self.options[name] for name in PROVIDER_OPTIONS):
+                provider = build_provider(options)
+        except (Exception, SystemExit) as ex:
+            # SystemExit as well; provider plugins may still exit on bad settings
+            log_err('Reloading configuration failed, keeping the current one: %s' % str(ex))
+            self._mtimes = self._stat()
+            return
+
+        CONFIG.update(config)
+        if provider is not None:
+            provider.max_records = options['max_records']
+            provider.max_records_aaaa = options['max_records_aaaa']
+        self.mon.reconfigure(dns_provider=provider,
+                             ban_list=ban_list,
+                             md_path=options['monerod_path'],
+                             md_address=options['monerod_address'],
+                             md_port=options['monerod_port'],
+                             md_auth=options['monerod_auth'],
+                             md_height_discovery_method=options['blockheight_discovery'])
+        self.options = options
+        self._mtimes = self._stat()
+        log_msg('Configuration reloaded')
+
+    def sleep(self, seconds: float):
+        """Sleeps `seconds`, reloading the configuration in between when needed"""
+        deadline = time.monotonic() + seconds
+        while True:
+            self.check()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(1, remaining))
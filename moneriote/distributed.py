@@ -0,0 +1,195 @@
+"""
+Sharded scanning across several moneriote processes.
+
+A worker (`moneriote --worker 127.0.0.1:18100`) serves `POST /scan`; it checks
+the posted nodes and streams every result back as one JSON line, with empty
+heartbeat lines in between while no result is ready. A coordinator
+(`moneriote --workers host:port,host:port`) splits its mass-scan candidates
+into one shard per worker by address hash and merges the streamed results.
+
+Workers are unauthenticated and connect to any node posted to them; bind them
+to a private address only.
+"""
+import json
+import queue
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from moneriote import CONFIG
+from moneriote.rpc import RpcNode, iter_scan
+from moneriote.utils import log_msg, log_err
+
+# seconds between heartbeat lines of a worker; the coordinator gives up on a
+# worker that sends nothing for this long plus twice the probe timeout
+HEARTBEAT_INTERVAL = 5
+
+
+def parse_address(address: str):
+    """Parses 'host:port' into a (host, port) tuple"""
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError("expected 'host:port', got \'%s\'" % address)
+    return host, int(port)
+
+
+def shard_index(netloc: str, shards: int):
+    """Stable shard index for `netloc` ('host:port'); the same on every host and run"""
+    return zlib.crc32(netloc.encode('utf-8')) % shards
+
+
+def partition(nodes, shards: int):
+    """
+    Splits `nodes` into `shards` lists by hash of their 'host:port'. Plain lists, not
+    `RpcNodeList`, as that would merge nodes on one host with different ports.
+    """
+    parts = [[] for _ in range(shards)]
+    for node in nodes:
+        parts[shard_index(node.netloc, shards)].append(node)
+    return parts
+
+
+def node_to_dict(node: RpcNode):
+    return {'address': node.address, 'port': node.port, 'dt': node.dt, 'latency': node.latency,
+            'latency_avg': node.latency_avg,
+            'valid': node.valid, 'failure': node.failure}
+
+
+def node_from_dict(data: dict):
+    data = dict(data)
+    valid = data.pop('valid', False)
+    failure = data.pop('failure', None)
+    node = RpcNode(**data)
+    node.valid = valid is True
+    node.failure = failure
+    return node
+
+
+def scan_distributed(nodes: list, blockchain_height: int, workers: list):
+    """
+    Scans `nodes` on the given workers, one shard per worker. Shards of workers
+    that cannot be reached are scanned locally instead.
+    :param workers: list of 'host:port' worker addresses
+    :return: list of all scanned nodes
+    """
+    results = []
+    lock = threading.Lock()
+
+    def on_result(node):
+        with lock:
+            results.append(node)
+
+    threads = []
+    for worker, shard in zip(workers, partition(nodes, len(workers))):
+        if len(shard) == 0:
+            continue
+        thread = threading.Thread(target=_scan_shard, args=(worker, shard, blockchain_height, on_result))
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _scan_shard(worker: str, shard: list, blockchain_height: int, on_result):
+    import requests
+
+    url = 'http://%s/scan' % worker
+    pending = {node.netloc: node for node in shard}
+    log_msg('Sending %d node(s) to worker %s' % (len(shard), worker))
+
+    # the read timeout applies per received chunk, so a stalled worker is detected mid-stream
+    read_timeout = HEARTBEAT_INTERVAL + 2 * CONFIG.get('probe_timeout', 2)
+    try:
+        resp = requests.post(url, stream=True, timeout=(5, read_timeout), json={
+            'height': blockchain_height,
+            'nodes': [node_to_dict(node) for node in shard]
+        })
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            node = node_from_dict(json.loads(line.decode('utf-8')))
+            pending.pop(node.netloc, None)
+            on_result(node)
+    except Exception as ex:
+        log_err('Worker %s failed: %s' % (worker, str(ex)))
+
+    if pending:
+        log_msg('Scanning %d node(s) of worker %s locally' % (len(pending), worker))
+        for node in iter_scan(list(pending.values()), blockchain_height, CONFIG.get('concurrent_scans', 20)):
+            on_result(node)
+
+
+class ScanWorkerHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != '/scan':
+            self.send_error(404)
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length).decode('utf-8'))
+            height = int(payload['height'])
+            nodes = [node_from_dict(node) for node in payload['nodes']]
+        except Exception as ex:
+            self.send_error(400, str(ex))
+            return
+
+        log_msg('Scanning %d node(s) for %s' % (len(nodes), self.client_address[0]))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+
+        # results are streamed as they complete, the connection close marks the end
+        results = queue.Queue()
+        stop = threading.Event()
+
+        def scan():
+            scanned = iter_scan(nodes, height, CONFIG.get('concurrent_scans', 20))
+            try:
+                for node in scanned:
+                    results.put(node)
+                    if stop.is_set():
+                        break
+            finally:
+                scanned.close()
+                results.put(None)
+
+        thread = threading.Thread(target=scan, daemon=True)
+        thread.start()
+        try:
+            while True:
+                try:
+                    node = results.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    line = '\n'
+                else:
+                    if node is None:
+                        break
+                    line = json.dumps(node_to_dict(node)) + '\n'
+                self.wfile.write(line.encode('utf-8'))
+                self.wfile.flush()
+        except OSError as ex:
+            log_err('Lost the connection to %s: %s' % (self.client_address[0], str(ex)))
+        finally:
+            stop.set()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ScanWorkerServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def run_worker(address: str):
+    """Serves scan requests on 'host:port' until interrupted"""
+    server = ScanWorkerServer(parse_address(address), ScanWorkerHandler)
+    log_msg('Scan worker listening on %s' % address)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -1,5 +1,26 @@
+from importlib import import_module
+
 from moneriote.rpc import RpcNode
 
+# provider modules are only imported once selected, so their dependencies
+# (e.g. suds for TransIP) are not loaded unless used
+PROVIDERS = {
+    'cloudflare': 'moneriote.dns.cloudflare.Cloudflare',
+    'transip': 'moneriote.dns.transip.TransIP',
+}
+
+
+def load_provider(name: str):
+    """
+    Imports and returns the `DnsProvider` class registered as `name`.
+    :return: provider class, or None when `name` is unknown
+    """
+    path = PROVIDERS.get(name)
+    if not path:
+        return
+    module_name, cls_name = path.rsplit('.', 1)
+    return getattr(import_module(module_name), cls_name)
+
 
 class DnsProvider(object):
     def __init__(self, **kwargs):
@@ -8,7 +29,15 @@ class DnsProvider(object):
         self.api_key = kwargs['api_key']
         self.api_email = kwargs['api_email']
         self.max_records = kwargs.get('max_records', 5)
+        self.max_records_aaaa = kwargs.get('max_records_aaaa', 0)
         self.headers = {}
+        # providers whose API is rate limited can set a `RequestScheduler` here
+        self.scheduler = None
+
+    @property
+    def record_types(self):
+        """Record types managed by this provider; AAAA only when enabled via `max_records_aaaa`"""
+        return ['A', 'AAAA'] if self.max_records_aaaa > 0 else ['A']
 
     @property
     def fulldomain_name(self):
@@ -22,3 +51,18 @@ class DnsProvider(object):
 
     def delete_record(self, node: RpcNode):
         raise NotImplementedError()
+
+    def apply_changes(self, adds: list, deletes: list):
+        """Adds and deletes records; through `self.scheduler` when set, one by one otherwise"""
+        if not self.scheduler:
+            for node in adds:
+                self.add_record(node)
+            for node in deletes:
+                self.delete_record(node)
+            return
+
+        for node in adds:
+            self.scheduler.add(node)
+        for node in deletes:
+            self.scheduler.delete(node)
+        self.scheduler.flush(self.add_record, self.delete_record)
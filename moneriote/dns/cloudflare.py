@@ -1,7 +1,8 @@
 import time
 from moneriote.dns import DnsProvider
+from moneriote.dns.scheduler import RequestScheduler
 from moneriote.rpc import RpcNode, RpcNodeList
-from moneriote.utils import log_err, log_msg, random_user_agent, make_json_request
+from moneriote.utils import log_err, log_msg, log_debug, random_user_agent, make_json_request
 
 
 class Cloudflare(DnsProvider):
@@ -17,15 +18,20 @@ class Cloudflare(DnsProvider):
         self.api_base = 'https://api.cloudflare.com/client/v4/zones'
         self.zone_id = None
 
+        # Cloudflare allows 1200 API calls per 5 minutes
+        self.scheduler = RequestScheduler(rate=kwargs.get('rate_limit', 4.0),
+                                          concurrency=kwargs.get('concurrency', 4))
+
         # zone_id is required and will be detected via Cloudflare API
         if not self.zone_id:
             log_msg('Determining zone_id; looking for \'%s\'' % self.domain_name)
             result = make_json_request(url=self.api_base, headers=self.headers)
+            # raised instead of exiting; fatal at start-up, a failed reload keeps the running provider
             try:
-                zones = result.get('result')
+                zones = result.get('result') or []
                 self.zone_id = next(zone.get('id') for zone in zones if zone.get('name') == self.domain_name)
-            except StopIteration:
-                log_err('could not determine zone_id. Is your Cloudflare domain correct?', fatal=True)
+            except (AttributeError, StopIteration):
+                raise ValueError('could not determine zone_id. Is your Cloudflare domain correct?')
             log_msg('Cloudflare zone_id \'%s\' matched to \'%s\'' % (self.zone_id, self.domain_name))
 
     def get_records(self):
@@ -36,19 +42,20 @@ class Cloudflare(DnsProvider):
         retries = 0
         while (True):
             try:
-                result = make_json_request('%s/%s/dns_records/?type=A&name=%s.%s' % (
+                result = self.scheduler.call(make_json_request, '%s/%s/dns_records/?name=%s.%s&per_page=100' % (
                     self.api_base, self.zone_id,
                     self.subdomain_name, self.domain_name), headers=self.headers)
                 records = result.get('result')
                 
-                # filter on A records / subdomain
+                # filter on A/AAAA records / subdomain
                 for record in records:
-                    if record.get('type') != 'A' or record.get('name') != self.fulldomain_name:
+                    if record.get('type') not in self.record_types or record.get('name') != self.fulldomain_name:
                         continue
 
                     node = RpcNode(address=record.get('content'), uid=record.get('id'))
                     nodes.append(node)
-                    log_msg('> A %s %s' % (record.get('name'), record.get('content')))
+                    log_debug('> %s %s %s' % (record.get('type'), record.get('name'), record.get('content')))
+                log_msg('Found %d record(s)' % len(nodes))
                 return nodes
             
             except Exception as ex:
@@ -62,25 +69,24 @@ class Cloudflare(DnsProvider):
     def add_record(self, node: RpcNode):
         log_msg('Record insertion: %s' % node.address)
 
-        try:
-            url = '%s/%s/dns_records' % (self.api_base, self.zone_id)
-            make_json_request(url=url, method='POST', verbose = False, headers=self.headers, json={
-                'name': self.subdomain_name,
-                'content': node.address,
-                'type': 'A',
-                'ttl': 120
-            })
-        except Exception as ex:
-            log_err("Cloudflare record (%s) insertion failed: %s" % (node.address, str(ex)))
+        # errors are raised, so the scheduler counts them as failed (and retries on 429)
+        url = '%s/%s/dns_records' % (self.api_base, self.zone_id)
+        data = make_json_request(url=url, method='POST', verbose=False, raise_errors=True, headers=self.headers, json={
+            'name': self.subdomain_name,
+            'content': node.address,
+            'type': node.record_type,
+            'ttl': 120
+        })
+        if not data or data.get('success') is not True:
+            raise Exception("Cloudflare record (%s) insertion failed: %s" % (node.address, (data or {}).get('errors')))
+        return data.get('result')
 
     def delete_record(self, node: RpcNode):
         # Delete DNS Record
         log_msg('Cloudflare record deletion: %s' % node.address)
 
-        try:
-            url = '%s/%s/dns_records/%s' % (self.api_base, self.zone_id, node.uid)
-            data = make_json_request(url=url, method='DELETE', verbose = False, headers=self.headers)
-            assert data.get('success') is True
-            return data.get('result')
-        except Exception as ex:
-            log_err("Record (%s) deletion failed: %s" % (node.address, str(ex)))
+        url = '%s/%s/dns_records/%s' % (self.api_base, self.zone_id, node.uid)
+        data = make_json_request(url=url, method='DELETE', verbose=False, raise_errors=True, headers=self.headers)
+        if not data or data.get('success') is not True:
+            raise Exception("Record (%s) deletion failed: %s" % (node.address, (data or {}).get('errors')))
+        return data.get('result')
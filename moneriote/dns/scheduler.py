@@ -0,0 +1,132 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from moneriote.rpc import RpcNode
+from moneriote.utils import log_msg, log_err, RateLimitError
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        """
+        :param rate: tokens (requests) added per second
+        :param burst: maximum amount of tokens that can be saved up
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Hands out no tokens for `seconds`, e.g. as instructed by a Retry-After header"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+class RequestScheduler:
+    """
+    Queues DNS record changes and runs them within the provider's API rate limit.
+    A change counts as failed when the provider's `add_record`/`delete_record` raises.
+    """
+    def __init__(self, rate: float = 4.0, burst: int = 10, concurrency: int = 4, max_retries: int = 5):
+        self.bucket = TokenBucket(rate=rate, burst=burst)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._pending = []
+        self._lock = threading.Lock()
+        self._metrics = {
+            'queue_depth': 0,
+            'max_queue_depth': 0,
+            'in_flight': 0,
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'throttled': 0
+        }
+
+    def add(self, node: RpcNode):
+        self._submit('add', node)
+
+    def delete(self, node: RpcNode):
+        self._submit('delete', node)
+
+    def _submit(self, op: str, node: RpcNode):
+        with self._lock:
+            self._metrics['submitted'] += 1
+            self._pending.append((op, node))
+            self._metrics['queue_depth'] = len(self._pending)
+            self._metrics['max_queue_depth'] = max(self._metrics['max_queue_depth'], len(self._pending))
+
+    def flush(self, add_fn, delete_fn):
+        """
+        Runs all queued changes, up to `concurrency` at a time.
+        :param add_fn: called with the node of every queued add
+        :param delete_fn: called with the node of every queued delete
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+
+        if not pending:
+            return
+
+        def run(item):
+            op, node = item
+            try:
+                self.call(add_fn if op == 'add' else delete_fn, node)
+            except Exception as ex:
+                log_err('DNS %s of %s failed: %s' % (op, node.address, str(ex)))
+                self._count('failed')
+            else:
+                self._count('completed')
+            finally:
+                self._count('queue_depth', -1)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(run, pending))
+
+    def call(self, fn, *args, **kwargs):
+        """Calls `fn` once the rate limit allows, retrying when the API answers 429"""
+        retries = 0
+        while True:
+            self.bucket.acquire()
+            self._count('in_flight', 1)
+            try:
+                return fn(*args, **kwargs)
+            except RateLimitError as ex:
+                self._count('throttled')
+                retries += 1
+                if retries > self.max_retries:
+                    raise
+                wait = ex.retry_after if ex.retry_after is not None else 2 ** retries
+                log_msg('DNS API rate limited, retrying in %.1f seconds' % wait)
+                self.bucket.pause(wait)
+            finally:
+                self._count('in_flight', -1)
+
+    def _count(self, key: str, value: int = 1):
+        with self._lock:
+            self._metrics[key] += value
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._metrics)
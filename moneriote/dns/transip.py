@@ -4,7 +4,6 @@ import time
 import uuid
 from collections import OrderedDict
 
-import rsa
 from suds.client import Client as SudsClient
 from suds.sudsobject import Object as SudsObject
 from suds.xsd.doctor import Import, ImportDoctor
@@ -19,15 +18,6 @@ try:
 except ImportError:
     suds_requests = None
 
-try:
-    from Crypto.Hash import SHA512
-    from Crypto.Signature import PKCS1_v1_5
-    from Crypto.PublicKey import RSA
-
-    HAS_PYCRYPTO = True
-except ImportError:
-    HAS_PYCRYPTO = False
-
 from moneriote.rpc import RpcNode, RpcNodeList
 from moneriote.dns import DnsProvider
 
@@ -95,13 +85,22 @@ class TransIP(DnsProvider):
             with open(self.private_key_file) as private_key:
                 keydata = private_key.read()
 
-                if HAS_PYCRYPTO:
+                # only one signing backend is needed; prefer pycrypto, fall back to rsa
+                try:
+                    from Crypto.Hash import SHA512
+                    from Crypto.Signature import PKCS1_v1_5
+                    from Crypto.PublicKey import RSA
+                except ImportError:
+                    RSA = None
+
+                if RSA is not None:
                     rsa_key = RSA.importKey(keydata)
                     rsa_ = PKCS1_v1_5.new(rsa_key)
                     sha512_hash_ = SHA512.new()
                     sha512_hash_.update(message.encode('utf-8'))
                     signature = rsa_.sign(sha512_hash_)
                 else:
+                    import rsa
                     privkey = rsa.PrivateKey.load_pkcs1(keydata)
                     signature = rsa.sign(
                         message.encode('utf-8'), privkey, 'SHA-512'
@@ -201,7 +200,7 @@ class TransIP(DnsProvider):
         return TransIPDnsEntry(**{
             'name': node.kwargs.get('name', self.subdomain_name),
             'expire': node.kwargs.get('expire', 60),
-            'record_type': node.kwargs.get('type', 'A'),
+            'record_type': node.kwargs.get('type', node.record_type),
             'content': node.address
         })
 
@@ -214,7 +213,7 @@ class TransIP(DnsProvider):
         for dnsentry in result.dnsEntries:
             if dnsentry.__class__.__name__ != 'DnsEntry':
                 continue
-            if dnsentry.type != 'A' and not all_records:
+            if dnsentry.type not in self.record_types and not all_records:
                 continue
             if dnsentry.name != self.subdomain_name and not all_records:
                 continue
@@ -1,5 +1,9 @@
 import functools
-from time import sleep
+import json
+import sys
+from time import perf_counter
+
+_T_START = perf_counter()
 
 import click
 click_option = functools.partial(click.option, show_default=True)
@@ -20,74 +24,169 @@ click_option = functools.partial(click.option, show_default=True)
 @click_option('--api-key', help="DNS API key.")
 @click_option('--api-email', help="DNS email address or username.")
 @click_option('--max-records', default=5, help='Maximum number of DNS records to add.')
+@click_option('--max-records-aaaa', default=0, help='Maximum number of AAAA (IPv6) records to add. 0 disables IPv6 '
+                                                    'scanning and AAAA records.')
+@click_option('--selection', default='random', type=click.Choice(['random', 'stable']),
+              help="'random' publishes a new random set of nodes every loop. 'stable' keeps published nodes while "
+                   "they stay valid and only replaces failed or clearly slower ones.")
+@click_option('--max-rotations', default=1, help="With 'stable' selection; the maximum amount of healthy records to "
+                                                 "replace per loop.")
+@click_option('--rotation-factor', default=2.0, help="With 'stable' selection; replace a healthy record when its "
+                                                     "latency is this many times that of the fastest spare node.")
+@click_option('--rotation-min-gap', default=0.1, help="With 'stable' selection; replace a healthy record only when "
+                                                      "its latency is also this many seconds above that of the "
+                                                      "fastest spare node.")
+@click_option('--dns-rate-limit', default=4.0, help='Maximum DNS API requests per second (Cloudflare).')
+@click_option('--dns-concurrency', default=4, help='Maximum concurrent DNS API requests (Cloudflare).')
 @click_option('--loop-interval', default=180, help='Loop interval for quickcheck nodes in cache and DNS records update.')
 @click_option('--scan-interval', default=1800, help='Interval at which to mass-scan RPC nodes.')
 @click_option('--concurrent_scans', default=20, help='The amount of servers to scan at once.')
+@click_option('--rpc-port', default=18089, help='RPC port of the nodes to scan and publish.')
+@click_option('--probe-timeout', default=2.0, help='Timeout in seconds of the HTTP check of a node. The upper bound '
+                                                   'with --adaptive-timeout.')
+@click_option('--block-offset', default=3, help='How many blocks a node may be behind to be considered valid.')
+@click_option('--height-timeout', default=5.0, help='Timeout in seconds of blockheight discovery requests.')
+@click_option('--height-retries', default=5, help='Retries of blockheight discovery requests.')
+@click_option('--adaptive-timeout', is_flag=True, help='Learn the probe timeout from the latencies of valid nodes.')
+@click_option('--adaptive-percentile', default=95.0, help='With --adaptive-timeout; the latency percentile to base '
+                                                          'the timeout on.')
+@click_option('--adaptive-margin', default=0.5, help='With --adaptive-timeout; fraction added on top of the '
+                                                     'percentile.')
+@click_option('--tcp-prefilter/--no-tcp-prefilter', default=True,
+              help='Only check nodes over HTTP that accept a TCP connection on their RPC port.')
+@click_option('--tcp-timeout', default=0.0, help='Timeout in seconds of the TCP connect pre-filter. 0 uses the probe '
+                                                 'timeout, the learned one with --adaptive-timeout.')
+@click_option('--tcp-max-in-flight', default=500, help='Maximum amount of concurrent TCP connects of the pre-filter.')
+@click_option('--negative-cache-ttl', default='refused=3600,timeout=1800,stale=600,error=900',
+              help='Seconds to skip nodes that failed their check, per failure type. 0 disables a type.')
+@click_option('--negative-cache-size', default=100000, help='Maximum amount of unreachable nodes to remember.')
 @click_option('--ban-list', help='Enable ban-list if list path is provided.')
 @click_option('--from-config', help='Load configuration from ini file.')
-def cli(monerod_path, monerod_address, monerod_port, monerod_auth, blockheight_discovery,
-        dns_provider, domain, subdomain, api_key, api_email, max_records, loop_interval,
-        concurrent_scans, scan_interval, ban_list, from_config):
+@click_option('--import-profile', is_flag=True, help='Report the time spent on imports and start-up.')
+@click_option('--log-level', default='info', type=click.Choice(['debug', 'info', 'warning', 'error']),
+              help='Minimum level of log messages. Per-node messages are logged at debug.')
+@click_option('--log-json', is_flag=True, help='Log JSON lines instead of coloured text.')
+@click_option('--once', is_flag=True, help='Run a single iteration and exit.')
+@click_option('--scan-only', is_flag=True, help='Scan nodes, write the nodes cache and exit. DNS records are left '
+                                                'untouched.')
+@click_option('--dry-run', is_flag=True, help='Compute the DNS record changes, print them and exit without '
+                                              'applying them.')
+@click_option('--summary-json', help="Append a JSON summary line per iteration to this path ('-' for stdout).")
+@click_option('--worker', help="Run as a scan worker listening on 'host:port'; other options are ignored.")
+@click_option('--workers', help="Comma separated 'host:port' scan workers to shard mass-scans over.")
+@click_option('--peer-daemons', help="Comma separated extra daemons ('host:port' or 'user:pass@host:port') to "
+                                     "collect peers from via RPC.")
+@click_option('--peer-public-nodes', default=0, help='Also collect peers from this many validated public nodes.')
+@click_option('--status-address', help="Serve the node inventory and scan state as JSON on 'host:port'.")
+@click_option('--profile', default=0, help='Profile the first N iterations with cProfile and a stack sampler.')
+@click_option('--slow-iteration', default=0.0, help='Write a sampled profile of iterations taking longer than this '
+                                                    'many seconds. 0 disables.')
+@click_option('--profile-dir', help='Directory to write profiles to. Defaults to \'moneriote-profiles\' in the '
+                                    'temporary directory.')
+def cli(**options):
+    from multiprocessing import freeze_support
+    freeze_support()
+
+    timings = [('cli', perf_counter() - _T_START)]
+    t = perf_counter()
     from moneriote import CONFIG
+    from moneriote.config import ConfigWatcher, apply_ini, build_config, build_provider
     from moneriote.moneriote import Moneriote
-    from moneriote.utils import log_err, log_msg, banner, parse_ini
-
-    banner()
-
-    if from_config:
-        md, dns, ban = parse_ini(from_config)
-        monerod_path = md['path']
-        monerod_address = md['address']
-        monerod_auth = md['auth']
-        monerod_port = md['port']
-        api_email = dns['api_email']
-        api_key = dns['api_key']
-        domain = dns['domain_name']
-        subdomain = dns['subdomain_name']
-        max_records = int(dns['max_records'])
-        dns_provider = dns['provider']
-        ban_list = ban['ban_list_path']
-
-    if not api_email:
-        log_err('Parameter api_email is required', fatal=True)
-
-    if not api_key:
-        log_err('Parameter api_key is required', fatal=True)
-
-    if not domain:
-        log_err('Parametre domain is required', fatal=True)
-
-    CONFIG['concurrent_scans'] = concurrent_scans
-    CONFIG['scan_interval'] = scan_interval
-
-    if dns_provider == 'cloudflare':
-        from moneriote.dns.cloudflare import Cloudflare
-        dns_provider = Cloudflare(
-            domain_name=domain,
-            subdomain_name=subdomain,
-            api_key=api_key,
-            api_email=api_email,
-            max_records=max_records)
-    elif dns_provider == 'transip':
-        from moneriote.dns.transip import TransIP
-        dns_provider = TransIP(
-            api_email=api_email,
-            api_key=api_key,
-            subdomain_name=subdomain,
-            domain_name=domain,
-            max_records=max_records)
-    else:
-        log_err("Unknown DNS provider \'%s\'" % dns_provider, fatal=True)
-
-    mon = Moneriote(dns_provider=dns_provider,
-                    md_path=monerod_path,
-                    md_address=monerod_address,
-                    md_port=monerod_port,
-                    md_auth=monerod_auth,
-                    md_height_discovery_method=blockheight_discovery,
-                    ban_list_path=ban_list)
+    from moneriote.utils import log_err, log_msg, banner, setup_logging
+    timings.append(('imports', perf_counter() - t))
+
+    # stdout is reserved for the summary lines with `--summary-json -`
+    stream = sys.stderr if options['summary_json'] == '-' else sys.stdout
+    setup_logging(level=options['log_level'], json_output=options['log_json'], stream=stream)
+    if not options['log_json']:
+        banner(stream=stream)
+
+    cli_options = options
+    try:
+        if options['from_config']:
+            options = apply_ini(options, options['from_config'])
+        CONFIG.update(build_config(options))
+    except ValueError as ex:
+        log_err(str(ex), fatal=True)
+
+    if options['worker']:
+        from moneriote.distributed import run_worker
+        run_worker(options['worker'])
+        return
+
+    scan_only, dry_run = options['scan_only'], options['dry_run']
+    if scan_only and dry_run:
+        log_err('--scan-only and --dry-run are mutually exclusive', fatal=True)
+
+    t = perf_counter()
+    dns_provider = None
+    # with --scan-only the DNS provider is never contacted
+    if not scan_only:
+        try:
+            dns_provider = build_provider(options)
+        except ValueError as ex:
+            log_err(str(ex), fatal=True)
+    timings.append(('dns provider', perf_counter() - t))
+
+    t = perf_counter()
+    try:
+        mon = Moneriote(dns_provider=dns_provider,
+                        md_path=options['monerod_path'],
+                        md_address=options['monerod_address'],
+                        md_port=options['monerod_port'],
+                        md_auth=options['monerod_auth'],
+                        md_height_discovery_method=options['blockheight_discovery'],
+                        ban_list_path=options['ban_list'])
+    except ValueError as ex:
+        log_err(str(ex), fatal=True)
+    timings.append(('monerod check', perf_counter() - t))
+
+    if options['status_address']:
+        from moneriote.status_api import start_status_server
+        try:
+            start_status_server(options['status_address'], mon.status)
+        except (ValueError, OSError) as ex:
+            log_err('Could not start the status API: %s' % str(ex), fatal=True)
+
+    if options['import_profile']:
+        log_msg('Start-up took %.1fms (%s)' % (
+            (perf_counter() - _T_START) * 1000,
+            ', '.join('%s: %.1fms' % (name, secs * 1000) for name, secs in timings)))
+
+    once = options['once'] or scan_only or dry_run
+    watcher = None
+    if not once:
+        watcher = ConfigWatcher(mon, cli_options=cli_options, options=options)
+        watcher.install_signal_handler()
+
+    profiler = None
+    if options['profile'] > 0 or options['slow_iteration'] > 0:
+        from moneriote import PATH_PROFILES
+        from moneriote.profiling import IterationProfiler
+        profiler = IterationProfiler(options['profile_dir'] or PATH_PROFILES,
+                                     iterations=options['profile'],
+                                     slow_threshold=options['slow_iteration'])
 
     while True:
-        mon.main()
-        log_msg('Sleeping for %d seconds' % loop_interval)
-        sleep(loop_interval)
+        if profiler:
+            summary = profiler.run(mon.main, scan_only=scan_only, dry_run=dry_run)
+        else:
+            summary = mon.main(scan_only=scan_only, dry_run=dry_run)
+        if options['summary_json']:
+            write_summary(summary, options['summary_json'])
+
+        if once:
+            raise SystemExit(1 if summary['error'] else 0)
+
+        log_msg('Sleeping for %d seconds' % CONFIG['loop_interval'])
+        watcher.sleep(CONFIG['loop_interval'])
+
+
+def write_summary(summary: dict, path: str):
+    """Writes an iteration summary as a single JSON line to `path`, or stdout when `path` is '-'"""
+    line = json.dumps(summary, sort_keys=True)
+    if path == '-':
+        print(line, flush=True)
+        return
+    with open(path, 'a') as f:
+        f.write(line + '\n')
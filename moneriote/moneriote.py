@@ -1,149 +1,357 @@
 import sys
 import re
 import os
+import json
+import queue
 import subprocess
+import threading
 import time
-from functools import partial
-from multiprocessing import Pool
+from itertools import chain
 from subprocess import Popen
 from datetime import datetime
 
-from moneriote import PATH_CACHE, CONFIG
+from moneriote import PATH_CACHE, PATH_NEGATIVE_CACHE, PATH_STATE, CONFIG
 from moneriote.dns import DnsProvider
-from moneriote.rpc import RpcNode, RpcNodeList
-from moneriote.utils import log_msg, log_err, make_json_request, banner, parse_ban_list
+from moneriote.negative_cache import NegativeCache, DEFAULT_TTLS
+from moneriote.peers import PeerDiscovery, PeerIndex
+from moneriote.rpc import RpcNode, RpcNodeList, AdaptiveTimeout, iter_scan, normalize_address
+from moneriote.selection import select_random, select_stable
+from moneriote.status import StatusStore
+from moneriote.utils import log_msg, log_err, log_debug, make_json_request, banner, parse_ban_list
 
 
 if sys.version_info[0] != 3 or sys.version_info[1] < 3.5:
     log_err("please run with python >= 3.5", fatal=True)
 
-try:
-    import requests
-except ImportError:
-    log_err("please install requests: pip install requests", fatal=True)
-
 
 class Moneriote:
     def __init__(self, dns_provider: DnsProvider, md_address: str = '127.0.0.1', md_port: int = 18081,
                  md_auth: str = 'not:used', md_path: str = 'monerod.exe',
                  md_height_discovery_method: str = 'xmrchain', ban_list_path: str = ''):
-        self.dns_provider = dns_provider
+        self._blockchain_height = None
+        # persisted, so runs from cron (`--once`) also honour `scan_interval`
+        self.last_mass_scan_time = self.load_state().get('last_mass_scan_time', 0)
+        # valid IPv6 nodes after the last mass-scan, see `_too_few_nodes`
+        self.last_mass_scan_ipv6 = 0
+        self.adaptive_timeout = None
+        self.negative_cache = NegativeCache(PATH_NEGATIVE_CACHE)
+        self.negative_cache.load()
+        self.peer_discovery = PeerDiscovery()
+        self.status = StatusStore()
 
-        self.md_path = md_path
-        self.md_daemon_addr = md_address
-        self.md_daemon_port = md_port
-        self.md_daemon_auth = md_auth
         if md_height_discovery_method not in ['xmrchain', 'monerod', 'compare', 'moneroblocks']:
             log_err('bad height_discovery_method option', fatal=True)
-        self.md_height_discovery_method = md_height_discovery_method
-
-        # default Monero RPC port
-        self._m_rpc_port = 18089
-        self._blockchain_height = None
-
-        self.last_mass_scan_time = 0
 
         if not os.path.isfile(PATH_CACHE):
             log_msg("Auto creating \'%s\'" % PATH_CACHE)
             f = open(PATH_CACHE, 'a')
             f.write('[]')
             f.close()
-        
-        if ban_list_path != '':
-            ban_list = parse_ban_list(ban_list_path)
-            log_msg('Load %d nodes from %s'%(len(ban_list), ban_list_path))
-            self.ban_list = ban_list
-        else:
-            self.ban_list = []
+
+        self.reconfigure(dns_provider=dns_provider,
+                         ban_list=self.load_ban_list(ban_list_path),
+                         md_path=md_path,
+                         md_address=md_address,
+                         md_port=md_port,
+                         md_auth=md_auth,
+                         md_height_discovery_method=md_height_discovery_method)
 
         self.monerod_check()
 
-    def main(self):
+    def reconfigure(self, dns_provider: DnsProvider, ban_list: set, md_address: str, md_port: int, md_auth: str,
+                    md_path: str, md_height_discovery_method: str):
+        """(Re)applies the settings given and those in `CONFIG`, keeping caches and learned state"""
+        self.dns_provider = dns_provider
+        self.ban_list = ban_list
+
+        self.md_path = md_path
+        self.md_daemon_addr = md_address
+        self.md_daemon_port = md_port
+        self.md_daemon_auth = md_auth
+        self.md_height_discovery_method = md_height_discovery_method
+
+        # default Monero RPC port
+        self._m_rpc_port = CONFIG.get('rpc_port', 18089)
+
+        if CONFIG.get('adaptive_timeout'):
+            if not self.adaptive_timeout:
+                self.adaptive_timeout = AdaptiveTimeout(maximum=CONFIG.get('probe_timeout', 2))
+            self.adaptive_timeout.maximum = CONFIG.get('probe_timeout', 2)
+            self.adaptive_timeout.percentile = CONFIG.get('adaptive_percentile', 95)
+            self.adaptive_timeout.margin = CONFIG.get('adaptive_margin', 0.5)
+        else:
+            self.adaptive_timeout = None
+
+        self.negative_cache.ttls = CONFIG.get('negative_cache_ttls', DEFAULT_TTLS)
+        self.negative_cache.max_size = CONFIG.get('negative_cache_size', 100000)
+
+        self.peer_discovery.daemons = CONFIG.get('peer_daemons') or []
+        self.peer_discovery.public_nodes = CONFIG.get('peer_public_nodes', 0)
+
+        # keep nodes for a few mass-scans in the status inventory
+        self.status.retention = 3 * CONFIG.get('scan_interval', 1800)
+
+    @staticmethod
+    def load_ban_list(path: str):
+        """:return: set of banned addresses; raises ValueError when `path` is missing"""
+        if not path:
+            return set()
+        if not os.path.isfile(path):
+            raise ValueError('%s missing' % path)
+        ban_list = {normalize_address(address) for address in parse_ban_list(path) if address}
+        log_msg('Load %d nodes from %s'%(len(ban_list), path))
+        return ban_list
+
+    @staticmethod
+    def load_state():
+        """:return: dict persisted by `save_state`, empty when missing or unreadable"""
+        try:
+            with open(PATH_STATE, 'r') as f:
+                state = json.loads(f.read())
+        except FileNotFoundError:
+            return {}
+        except Exception as ex:
+            log_err('Reading \'%s\' failed' % PATH_STATE)
+            return {}
+        return state if isinstance(state, dict) else {}
+
+    def save_state(self):
+        tmp = PATH_STATE + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                f.write(json.dumps({'last_mass_scan_time': self.last_mass_scan_time}))
+            os.replace(tmp, PATH_STATE)
+        except Exception as ex:
+            log_err('Writing \'%s\' failed' % PATH_STATE)
+
+    def main(self, scan_only=False, dry_run=False):
+        """
+        Runs a single update iteration.
+        :param scan_only: only refresh the nodes cache, leave the DNS records untouched
+        :param dry_run: compute the DNS record changes without applying them
+        :return: summary of the iteration; timings, chosen nodes and DNS changes
+        """
+        started = time.time()
+        summary = {
+            'mode': 'scan-only' if scan_only else 'dry-run' if dry_run else 'update',
+            'started': started,
+            'height': None,
+            'timings': {},
+            'scanned': {'cache': 0, 'peers': 0, 'banned': 0, 'skipped': 0},
+            'valid': 0,
+            'chosen': [],
+            'dns': None,
+            'error': None
+        }
+
+        def finish(error=None):
+            if error:
+                log_err(error)
+            summary['error'] = error
+            summary['timings']['total'] = time.time() - started
+            self.status.iteration_finished(summary,
+                                           next_iteration=time.time() + CONFIG.get('loop_interval', 180),
+                                           next_mass_scan=self.last_mass_scan_time + CONFIG['scan_interval'])
+            return summary
+
         # get & set the current blockheight
+        self.status.set_phase('height')
+        t = time.time()
         height = self.monerod_get_height(method=self.md_height_discovery_method)
+        summary['timings']['height'] = time.time() - t
         if not height or not isinstance(height, int):
-            log_err("Unable to fetch the current blockchain height")
-            return
+            return finish("Unable to fetch the current blockchain height")
         self._blockchain_height = height
+        summary['height'] = height
 
+        t = time.time()
         nodes = RpcNodeList()
         nodes += RpcNodeList.cache_read(PATH_CACHE)  # from `cached_nodes.json`
         if nodes:
-            nodes = self.scan(nodes, remove_invalid=True)
-        
+            counts = {}
+            nodes = self.scan(nodes, remove_invalid=True, phase='cache scan', counts=counts)
+            self._add_counts(summary['scanned'], counts, 'cache')
+        summary['timings']['cache_scan'] = time.time() - t
+
         now = time.time()
         this_round_uptime = now - self.last_mass_scan_time
-
-        if len(nodes.nodes) <= self.dns_provider.max_records or this_round_uptime > CONFIG['scan_interval']:
-            peers = self.monerod_get_peers()  # from monerod
-            nodes += self.scan(peers, remove_invalid=True)
+        # a separate --scan-only run always mass-scans, update runs can then publish from the cache
+        if scan_only or self._too_few_nodes(nodes) or this_round_uptime > CONFIG['scan_interval']:
+            # peers are scanned while they are being collected; nodes from the
+            # cache were checked above already
+            index = PeerIndex()
+            peers = self.peer_discovery.discover(index, local=self.monerod_iter_peers,
+                                                 validated=nodes, exclude=nodes)
+            counts = {}
+            nodes += self.scan(peers, remove_invalid=True, phase='mass scan', mass_scan=True, counts=counts)
+            self._add_counts(summary['scanned'], counts, 'peers')
+            summary['scanned']['sources'] = index.sources()
             self.last_mass_scan_time = now
+            self.last_mass_scan_ipv6 = len([node for node in nodes if node.is_ipv6])
+            self.save_state()
+            summary['timings']['mass_scan'] = time.time() - now
+
+        summary['valid'] = len(nodes)
+        if len(nodes.nodes) == 0:
+            return finish('Could not get any valid node, skipping this update.')
+
+        nodes.cache_write()
+        if scan_only:
+            return finish()
+
+        t = time.time()
+        self.status.set_phase('dns')
+        summary['dns'] = self.update_dns(nodes, dry_run=dry_run)
+        summary['timings']['dns'] = time.time() - t
+        if summary['dns'] is None:
+            return finish('Could not fetch DNS records, skipping this update.')
+        summary['chosen'] = summary['dns']['chosen']
+        return finish()
+
+    @staticmethod
+    def _add_counts(scanned: dict, counts: dict, key: str):
+        """Adds the counts of a `scan` to the summary; `key` gets the amount of nodes actually checked"""
+        scanned[key] = counts.get('scanned', 0)
+        scanned['banned'] += counts.get('banned', 0)
+        scanned['skipped'] += counts.get('skipped', 0)
+
+    def _too_few_nodes(self, nodes: RpcNodeList):
+        """
+        True when there are not enough valid nodes to fill the A record set, or when the AAAA
+        record set could be filled after the last mass-scan but no longer can. Public IPv6 nodes
+        are rare; rescanning whenever there are too few of them would mass-scan every loop.
+        """
+        if not self.dns_provider:
+            return len(nodes) == 0
+        ipv4 = len([node for node in nodes if not node.is_ipv6])
+        if ipv4 <= self.dns_provider.max_records:
+            return True
+        limit = self.dns_provider.max_records_aaaa
+        if limit > 0:
+            return len(nodes) - ipv4 < limit <= self.last_mass_scan_ipv6
+        return False
 
-        if len(nodes.nodes) > 0:
-            nodes.cache_write()
-
-            nodes.shuffle()
+    def update_dns(self, nodes: RpcNodeList, dry_run=False):
+        """
+        Publishes a selection of `nodes` as DNS records; up to `max_records`
+        A records and `max_records_aaaa` AAAA records. See `moneriote.selection`.
+        :param dry_run: only compute the changes, do not call the DNS provider
+        :return: dict with the current, chosen, added and deleted addresses;
+        None when the current records could not be fetched
+        """
+        dns_nodes = self.dns_provider.get_records()
+        if dns_nodes is None:
+            return
 
-            inserts = nodes.nodes[:self.dns_provider.max_records]
-            insert_ips = []
-            for node in inserts:
-                insert_ips.append(node.address)
-            
-            dns_nodes = self.dns_provider.get_records()
+        inserts = []
+        for record_type, limit in (('A', self.dns_provider.max_records),
+                                   ('AAAA', self.dns_provider.max_records_aaaa)):
+            candidates = [node for node in nodes if node.record_type == record_type]
+            if CONFIG.get('selection') == 'stable':
+                inserts += select_stable([node for node in dns_nodes if node.record_type == record_type],
+                                         candidates, limit,
+                                         max_rotations=CONFIG.get('max_rotations', 1),
+                                         rotation_factor=CONFIG.get('rotation_factor', 2.0),
+                                         rotation_min_gap=CONFIG.get('rotation_min_gap', 0.1))
+            else:
+                inserts += select_random(candidates, limit)
+        insert_ips = [node.address for node in inserts]
 
-            if dns_nodes != None:
-                # insert new records
-                for node in inserts:
-                    if node.address not in dns_nodes:
-                        self.dns_provider.add_record(node)
+        adds = [node for node in inserts if node.address not in dns_nodes]
+        deletes = [node for node in dns_nodes if node.address not in insert_ips]
 
-                # remove old records
-                for node in dns_nodes:
-                    if node.address not in insert_ips:
-                        self.dns_provider.delete_record(node)
-            else:
-                log_err('Could not fetch DNS records, skipping this update.')
-        
+        if dry_run:
+            for node in adds:
+                log_msg('Dry-run: would insert %s' % node.address)
+            for node in deletes:
+                log_msg('Dry-run: would delete %s' % node.address)
         else:
-            log_err('Could not get any valid node, skipping this update.')
-
-    def scan(self, nodes: RpcNodeList, remove_invalid=False):
+            self.dns_provider.apply_changes(adds, deletes)
+
+        return {
+            'current': [node.address for node in dns_nodes],
+            'chosen': insert_ips,
+            'add': [node.address for node in adds],
+            'delete': [node.address for node in deletes],
+            'applied': not dry_run,
+            'scheduler': self.dns_provider.scheduler.metrics() if self.dns_provider.scheduler else None
+        }
+
+    def scan(self, nodes, remove_invalid=False, phase='scan', mass_scan=False, counts: dict = None):
         """
-        Start threads checking known nodes to see if they're alive.
-        :param nodes:
+        Start processes checking nodes to see if they're alive.
+        :param nodes: RpcNodeList, or any iterable of RpcNode. Generators are consumed
+        while scanning, so checks start before the generator is exhausted.
         :param remove_invalid: only return valid nodes when set to True
+        :param phase: name of the scan as reported by the status API
+        :param mass_scan: scan of newly discovered peers; TCP pre-filtered, and sharded over
+        `CONFIG['workers']` when set
+        :param counts: when given, set to the amount of nodes 'scanned', 'banned' and 'skipped'
         :return: valid nodes
         """
-        if len(nodes) == 0:
-            return nodes
-
-        if len(self.ban_list) > 0:
-            filtered_nodes = RpcNodeList()
-            for node in nodes:
-                if node.address in self.ban_list:
-                    log_msg('Ban %s'%node.address)
-                else:
-                    filtered_nodes.append(node)
-            nodes = filtered_nodes
+        skipped, banned = [], []
+        if counts is None:
+            counts = {}
+        counts.update(scanned=0, banned=0, skipped=0)
+        nodes = iter(self._filter_nodes(nodes, skipped, banned))
+        try:
+            first = next(nodes)
+        except StopIteration:
+            log_msg('Nothing to scan; skipped %d banned and %d recently unreachable node(s)' % (
+                len(banned), len(skipped)))
+            counts.update(banned=len(banned), skipped=len(skipped))
+            return RpcNodeList()
+        nodes = chain([first], nodes)
 
         now = datetime.now()
-        log_msg('Scanning %d node(s) on port %d. This can take several minutes. Let it run.' % (
-            len(nodes), self._m_rpc_port))
-
-        pool = Pool(processes=CONFIG['concurrent_scans'])
-        nodes = RpcNodeList.from_list(pool.map(partial(RpcNode.is_valid, self._blockchain_height), nodes))
-        pool.close()
-        pool.join()
+        self.status.scan_started(phase)
+        log_msg('Scanning node(s) on port %d. This can take several minutes. Let it run.' % self._m_rpc_port)
 
-        log_msg('Scanning %d node(s) done after %d seconds, found %d valid' % (
-            len(nodes), (datetime.now() - now).total_seconds(), len(nodes.valid(valid=True))))
+        if mass_scan and CONFIG.get('workers'):
+            from moneriote.distributed import scan_distributed
+            results = scan_distributed(list(nodes), self._blockchain_height, CONFIG['workers'])
+        else:
+            # cached nodes were valid before; a slow handshake should not drop them
+            results = iter_scan(nodes, self._blockchain_height, CONFIG['concurrent_scans'],
+                                adaptive=self.adaptive_timeout, prefilter=mass_scan)
+        nodes = RpcNodeList.from_list(self.status.track(results))
+        self.status.scan_finished(nodes, skipped=len(skipped), banned=len(banned))
+        counts.update(scanned=len(nodes), banned=len(banned), skipped=len(skipped))
+
+        log_msg('Scanning %d node(s) done after %d seconds, found %d valid, skipped %d banned and %d recently '
+                'unreachable' % (len(nodes), (datetime.now() - now).total_seconds(), len(nodes.valid(valid=True)),
+                                 len(banned), len(skipped)))
+        if self.adaptive_timeout:
+            log_msg('Adaptive probe timeout is %.2f seconds' % self.adaptive_timeout.timeout)
+
+        self.negative_cache.update(nodes)
+        self.negative_cache.save()
 
         if remove_invalid:
             nodes = nodes.valid(valid=True)
 
         return nodes
 
+    def _filter_nodes(self, nodes, skipped: list, banned: list):
+        """Drops banned and recently unreachable nodes, and IPv6 nodes unless enabled"""
+        ipv6 = CONFIG.get('ipv6')
+        for node in nodes:
+            if node.address in self.ban_list:
+                log_debug('Ban %s'%node.address)
+                banned.append(node)
+            elif node.is_ipv6 and not ipv6:
+                continue
+            elif node in self.negative_cache:
+                skipped.append(node)
+            else:
+                yield node
+
     def monerod_check(self):
+        try:
+            import requests
+        except ImportError:
+            log_err("please install requests: pip install requests", fatal=True)
+
         url = 'http://%s:%d' % (self.md_daemon_addr, self.md_daemon_port)
 
         try:
@@ -163,7 +371,8 @@ class Moneriote:
         """
         data = {}
         xmrchain_height = 0
-        max_retries = 5
+        max_retries = CONFIG.get('height_retries', 5)
+        timeout = CONFIG.get('height_timeout', 5)
 
         if method == ['compare', 'monerod']:
             output = self._daemon_command(cmd="print_height")
@@ -181,7 +390,7 @@ class Moneriote:
                 if retries > max_retries:
                     break
                 try:
-                    blob = make_json_request('https://moneroblocks.info/api/get_stats/', timeout=5, verify=True)
+                    blob = make_json_request('https://moneroblocks.info/api/get_stats/', timeout=timeout, verify=True)
                     data['moneroblocks'] = blob.get('height')
                     break
                 except Exception as ex:
@@ -195,7 +404,8 @@ class Moneriote:
                 if retries > max_retries:
                     break
                 try:
-                    blob = make_json_request('https://xmrchain.net/api/networkinfo', timeout=5, verify=True)
+                    blob = make_json_request('https://xmrchain.net/api/networkinfo', timeout=timeout,
+                                             verify=True)
                     assert blob.get('status') == 'success'
                     data['xmrchain_height'] = blob.get('data', {}).get('height')
                     assert isinstance(data['xmrchain_height'], int)
@@ -213,25 +423,26 @@ class Moneriote:
             return max(data.values())
         log_err('Unable to obtain blockheight.')
 
-    def monerod_get_peers(self):
-        """Gets the last known peers from monerod"""
-        nodes = RpcNodeList()
-        output = self._daemon_command("print_pl")
-        if not output:
-            return nodes
-
-        regex = r"(gray|white)\s+(\w+)\s+(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}):(\d{1,5})"
-        matches = re.finditer(regex, output)
-
-        for i, match in enumerate(matches):
-            if match.group(1) != 'white':
-                continue
+    def monerod_iter_peers(self):
+        """Yields the white peers of monerod while `print_pl` output is being read"""
+        # ipv6 peers are printed as '[2001:db8::1]:18080'
+        regex = re.compile(r"(gray|white)\s+(\w+)\s+(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}|\[[0-9a-fA-F:.]+\]):(\d{1,5})")
 
-            address = match.group(3)
-            nodes.append(RpcNode(address=address))
+        for line in self._iter_daemon_command("print_pl"):
+            for match in regex.finditer(line):
+                if match.group(1) != 'white':
+                    continue
+                yield RpcNode(address=match.group(3))
 
-        log_msg('Got peers from RPC: %d node(s)' % len(nodes))
-        return nodes
+    def _daemon_args(self, cmd: str):
+        args = [
+            '--rpc-bind-ip', self.md_daemon_addr,
+            '--rpc-bind-port', str(self.md_daemon_port),
+        ]
+        if self.md_daemon_auth:
+            args.extend(['--rpc-login', self.md_daemon_auth])
+        args.append(cmd)
+        return args
 
     def _daemon_command(self, cmd: str):
         if not os.path.exists(self.md_path):
@@ -241,14 +452,9 @@ class Moneriote:
         log_msg("Spawning daemon; executing command \'%s\'" % cmd)
 
         # build proc args
-        args = [
-            '--rpc-bind-ip', self.md_daemon_addr,
-            '--rpc-bind-port', str(self.md_daemon_port),
-        ]
-        if self.md_daemon_auth:
-            args.extend(['--rpc-login', self.md_daemon_auth])
-        args.append(cmd)
+        args = self._daemon_args(cmd)
 
+        process = None
         try:
             process = Popen([self.md_path, *args],
                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
@@ -263,4 +469,61 @@ class Moneriote:
             ))
         finally:
             # cleanup
+            if process:
+                process.kill()
+
+    def _iter_daemon_command(self, cmd: str, timeout: int = 10):
+        """Like `_daemon_command`, but yields the output line by line as monerod writes it"""
+        if not os.path.exists(self.md_path):
+            log_err("monerod not found in path \'%s\'" % self.md_path)
+            return
+
+        log_msg("Spawning daemon; executing command \'%s\'" % cmd)
+        args = self._daemon_args(cmd)
+
+        try:
+            process = Popen([self.md_path, *args],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True, bufsize=1)
+        except Exception as ex:
+            log_err('Could not spawn \'%s %s\': %s' % (
+                self.md_path, ' '.join(args), str(ex)
+            ))
+            return
+
+        # a reader thread drains the output as monerod writes it, so a slow consumer
+        # never blocks monerod and the timeout only applies to monerod itself
+        output = queue.Queue()
+
+        def read():
+            try:
+                for line in process.stdout:
+                    output.put(line)
+            finally:
+                output.put(None)
+
+        def kill():
+            if process.poll() is None:
+                log_err("monerod did not finish '%s' within %d seconds, its output is incomplete" % (cmd, timeout))
+                process.kill()
+
+        reader = threading.Thread(target=read, name='monerod-reader', daemon=True)
+        reader.start()
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+        lines = 0
+        try:
+            while True:
+                line = output.get()
+                if line is None:
+                    break
+                lines += 1
+                yield line
+        finally:
+            timer.cancel()
             process.kill()
+            process.wait()
+            reader.join()
+            process.stdout.close()
+            if not lines:
+                log_err("No output from monerod")
@@ -0,0 +1,133 @@
+"""
+Bounded cache of recently unreachable nodes, so mass-scans do not wait out the
+probe timeout on the same dead peers every time.
+
+Entries expire after a TTL that depends on why the check failed
+(see `RpcNode.is_valid`); the least recently used entries are evicted once
+`max_size` is reached. The cache is persisted to `PATH_NEGATIVE_CACHE`.
+"""
+import json
+import os
+import time
+from collections import OrderedDict
+
+from moneriote.rpc import RpcNode
+from moneriote.utils import log_msg, log_err
+
+# seconds to skip a node, per failure type; 0 disables caching that failure type
+DEFAULT_TTLS = {
+    'refused': 3600,
+    'timeout': 1800,
+    'stale': 600,
+    'error': 900
+}
+
+
+def parse_ttls(value: str):
+    """Parses 'refused=3600,timeout=1800' into a TTL dict, on top of `DEFAULT_TTLS`"""
+    ttls = dict(DEFAULT_TTLS)
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        failure, _, ttl = item.partition('=')
+        failure = failure.strip()
+        if failure not in DEFAULT_TTLS or not ttl.strip().isdigit():
+            raise ValueError("bad negative cache TTL \'%s\'" % item)
+        ttls[failure] = int(ttl)
+    return ttls
+
+
+class NegativeCache:
+    def __init__(self, path: str, ttls: dict = None, max_size: int = 100000):
+        self.path = path
+        self.ttls = ttls or DEFAULT_TTLS
+        self.max_size = max_size
+        # (address, port) -> (expires, failure), oldest first
+        self._entries = OrderedDict()
+
+    def add(self, node: RpcNode):
+        """Remembers a node that failed its check"""
+        ttl = self.ttls.get(node.failure, 0)
+        if ttl <= 0:
+            return
+        key = (node.address, node.port)
+        self._entries[key] = (time.time() + ttl, node.failure)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def discard(self, node: RpcNode):
+        self._entries.pop((node.address, node.port), None)
+
+    def update(self, nodes):
+        """Adds failed and forgets valid nodes from a scan"""
+        for node in nodes:
+            if node.valid:
+                self.discard(node)
+            elif node.failure:
+                self.add(node)
+
+    def __contains__(self, node: RpcNode):
+        key = (node.address, node.port)
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        if entry[0] < time.time():
+            del self._entries[key]
+            return False
+        self._entries.move_to_end(key)
+        return True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def evict_expired(self):
+        now = time.time()
+        for key in [key for key, (expires, _) in self._entries.items() if expires < now]:
+            del self._entries[key]
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                blob = json.loads(f.read())
+            if not isinstance(blob, list):
+                raise ValueError('expected a list')
+        except FileNotFoundError:
+            return
+        except Exception as ex:
+            log_err('Reading \'%s\' failed: %s' % (self.path, str(ex)))
+            return
+
+        now = time.time()
+        entries = []
+        for entry in blob:
+            if not self._valid_entry(entry):
+                continue
+            address, port, expires, failure = entry
+            if expires > now:
+                entries.append((expires, address, port, failure))
+
+        # the entries closest to expiry are the first to go when over `max_size`
+        for expires, address, port, failure in sorted(entries)[-self.max_size:]:
+            self._entries[(address, port)] = (expires, failure)
+        if len(entries) < len(blob):
+            log_msg('Ignored %d expired or malformed entries in \'%s\'' % (len(blob) - len(entries), self.path))
+        log_msg('Loaded %d unreachable nodes from \'%s\'' % (len(self._entries), self.path))
+
+    @staticmethod
+    def _valid_entry(entry):
+        return isinstance(entry, list) and len(entry) == 4 and \
+            isinstance(entry[0], str) and isinstance(entry[1], int) and \
+            isinstance(entry[2], (int, float)) and entry[3] in DEFAULT_TTLS
+
+    def save(self):
+        self.evict_expired()
+        data = [[address, port, expires, failure] for (address, port), (expires, failure) in self._entries.items()]
+        # written to a temporary file first, an interrupted write leaves the previous file intact
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                f.write(json.dumps(data))
+            os.replace(tmp, self.path)
+        except Exception as ex:
+            log_err('Writing \'%s\' failed' % self.path)
@@ -0,0 +1,129 @@
+"""
+Peer discovery; collects candidate nodes from several sources concurrently.
+
+Sources are the local monerod (`print_pl`), extra daemons given by
+`--peer-daemons` and, optionally, a sample of already validated public nodes.
+Both of the latter are asked for their `/get_peer_list` over RPC.
+"""
+import random
+import socket
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from moneriote.rpc import RpcNode, RpcNodeList
+from moneriote.utils import log_msg, log_err, make_json_request
+
+
+class PeerIndex:
+    """Deduplicated union of peer lists, remembering where and when each address was first seen"""
+    def __init__(self):
+        self.nodes = RpcNodeList()
+        self.first_seen = {}
+
+    def add(self, node: RpcNode, source: str):
+        """:return: True when `node` was not seen before"""
+        if node.address in self.first_seen:
+            return False
+        self.first_seen[node.address] = (time.time(), source)
+        self.nodes.append(node)
+        return True
+
+    def merge(self, nodes, source: str):
+        """:return: amount of new addresses"""
+        return sum(1 for node in nodes if self.add(node, source))
+
+    def sources(self):
+        """:return: dict of source -> amount of addresses first seen there"""
+        counts = {}
+        for _, source in self.first_seen.values():
+            counts[source] = counts.get(source, 0) + 1
+        return counts
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+def fetch_peer_list(daemon: str, timeout: int = 5):
+    """
+    Fetches the white peer list of a daemon via its `/get_peer_list` RPC.
+    :param daemon: 'host:port', optionally prefixed with 'user:pass@'
+    :return: RpcNodeList
+    """
+    kwargs = {}
+    if '@' in daemon:
+        from requests.auth import HTTPDigestAuth
+        login, daemon = daemon.rsplit('@', 1)
+        user, _, password = login.partition(':')
+        kwargs['auth'] = HTTPDigestAuth(user, password)
+
+    nodes = RpcNodeList()
+    blob = make_json_request('http://%s/get_peer_list' % daemon, verbose=False, timeout=timeout, **kwargs)
+    if not blob:
+        return nodes
+
+    for peer in blob.get('white_list', []):
+        address = peer.get('host')
+        if not address and isinstance(peer.get('ip'), int):
+            address = socket.inet_ntoa(struct.pack('<I', peer['ip']))
+        if address:
+            nodes.append(RpcNode(address=address))
+    return nodes
+
+
+class PeerDiscovery:
+    def __init__(self, daemons: list = None, public_nodes: int = 0, timeout: int = 5, threads: int = 8):
+        """
+        :param daemons: extra daemons ('host:port') to collect peers from
+        :param public_nodes: amount of validated public nodes to collect peers from
+        """
+        self.daemons = daemons or []
+        self.public_nodes = public_nodes
+        self.timeout = timeout
+        self.threads = threads
+
+    def discover(self, index: PeerIndex, local=None, validated: RpcNodeList = None, exclude: RpcNodeList = None):
+        """
+        Collects peers from all sources concurrently, yielding every new address as soon
+        as it comes in so it can be scanned right away.
+        :param index: PeerIndex the peers are merged into
+        :param local: callable returning an iterable of the local monerod peers; it is
+        consumed in the calling thread while the other sources are fetched in the background
+        :param validated: known valid nodes; a sample of them is asked for peers
+        :param exclude: nodes that are indexed, but not yielded
+        """
+        remote = []
+        for daemon in self.daemons:
+            remote.append((daemon, self._fetcher(daemon)))
+        if validated and self.public_nodes > 0:
+            sample = random.sample(validated.nodes, min(self.public_nodes, len(validated)))
+            for node in sample:
+                remote.append(('public', self._fetcher(node.netloc)))
+
+        def new(nodes, source):
+            for node in nodes:
+                if index.add(node, source) and not (exclude and node.address in exclude):
+                    yield node
+
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.threads, len(remote))))
+        futures = {executor.submit(fetch): name for name, fetch in remote}
+        try:
+            if local:
+                yield from new(local(), 'monerod')
+
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    nodes = future.result()
+                except Exception as ex:
+                    log_err('Collecting peers from %s failed: %s' % (name, str(ex)))
+                    continue
+                yield from new(nodes, name)
+        finally:
+            executor.shutdown(wait=False)
+
+        log_msg('Discovered %d unique peer(s) (%s)' % (
+            len(index), ', '.join('%s: %d' % item for item in sorted(index.sources().items()))))
+
+    def _fetcher(self, daemon: str):
+        return lambda: fetch_peer_list(daemon, timeout=self.timeout)
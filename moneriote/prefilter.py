@@ -0,0 +1,97 @@
+"""
+Cheap first scan phase; a non-blocking TCP connect to the RPC port of many
+nodes at once. Only nodes accepting the connection go on to the HTTP
+`/getheight` check of `RpcNode.is_valid`.
+"""
+import errno
+import selectors
+import socket
+import time
+from collections import OrderedDict
+
+from moneriote.rpc import RpcNode
+
+_IN_PROGRESS = {0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN, 10035}  # 10035: WSAEWOULDBLOCK
+
+
+def iter_open(nodes, rejected, timeout: float = 0.5, max_in_flight: int = 500):
+    """
+    Tries to connect to every node, keeping up to `max_in_flight` connects pending.
+    :param nodes: iterable of RpcNode; consumed as connect slots free up
+    :param rejected: nodes that did not accept the connection are appended to this, with
+    `failure` set to 'refused' or 'timeout'
+    :return: generator yielding the nodes that accepted the connection
+    """
+    selector = selectors.DefaultSelector()
+    in_flight = OrderedDict()  # socket -> (node, deadline); deadlines are in insertion order
+    nodes = iter(nodes)
+    held = None
+    exhausted = False
+
+    def reject(node: RpcNode, failure: str):
+        node.valid = False
+        node.failure = failure
+        rejected.append(node)
+
+    def close(sock):
+        selector.unregister(sock)
+        sock.close()
+        return in_flight.pop(sock)[0]
+
+    try:
+        while True:
+            # start connects until the in-flight limit is hit
+            while not exhausted and len(in_flight) < max_in_flight:
+                if held is not None:
+                    node, held = held, None
+                else:
+                    try:
+                        node = next(nodes)
+                    except StopIteration:
+                        exhausted = True
+                        break
+
+                try:
+                    sock = socket.socket(socket.AF_INET6 if node.is_ipv6 else socket.AF_INET, socket.SOCK_STREAM)
+                except OSError:
+                    # most likely out of file descriptors; retry once connects completed
+                    if in_flight:
+                        held = node
+                        break
+                    reject(node, 'error')
+                    continue
+
+                sock.setblocking(False)
+                err = sock.connect_ex((node.address, node.port))
+                if err not in _IN_PROGRESS:
+                    sock.close()
+                    reject(node, 'refused')
+                    continue
+                selector.register(sock, selectors.EVENT_WRITE, node)
+                in_flight[sock] = (node, time.monotonic() + timeout)
+
+            if not in_flight:
+                if exhausted and held is None:
+                    return
+                continue
+
+            oldest_deadline = next(iter(in_flight.values()))[1]
+            for key, _ in selector.select(timeout=max(0, oldest_deadline - time.monotonic())):
+                sock = key.fileobj
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                node = close(sock)
+                if err == 0:
+                    yield node
+                else:
+                    reject(node, 'refused')
+
+            now = time.monotonic()
+            while in_flight:
+                sock, (node, deadline) = next(iter(in_flight.items()))
+                if deadline > now:
+                    break
+                reject(close(sock), 'timeout')
+    finally:
+        for sock in list(in_flight):
+            close(sock)
+        selector.close()
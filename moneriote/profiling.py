@@ -0,0 +1,131 @@
+"""
+Per-iteration profiling of `Moneriote.main`.
+
+Profiled iterations (`--profile N`, the first N) run under cProfile and a
+stack sampler; the cProfile stats are written as `.prof` (open with `pstats`
+or snakeviz) and the samples as a `.collapsed` file, one 'frame;frame;frame count'
+line per stack, the input format of flamegraph.pl and speedscope.
+
+With `--slow-iteration SECONDS`, all other iterations run under a low-rate
+sampler only, which is written when the iteration took longer than that.
+
+Samples are taken of every thread of this process, the thread name being the
+root frame; time spent in the `Pool` processes or monerod shows up as the
+main thread waiting on them.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from time import perf_counter
+
+from moneriote.utils import log_msg, log_err
+
+
+class StackSampler:
+    def __init__(self, interval: float = 0.005):
+        """:param interval: seconds between samples"""
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.stacks[self._collapse(names.get(ident, str(ident)), frame)] += 1
+
+    @staticmethod
+    def _collapse(thread_name: str, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        frames.append(thread_name)
+        return ';'.join(reversed(frames))
+
+    def write(self, path: str):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('%s %d\n' % (stack, count))
+
+
+class IterationProfiler:
+    def __init__(self, directory: str, iterations: int = 0, slow_threshold: float = 0,
+                 interval: float = 0.005, slow_interval: float = 0.05):
+        """
+        :param directory: where the profiles are written
+        :param iterations: amount of iterations, from the first, to profile in full
+        :param slow_threshold: seconds; keep the samples of later iterations taking longer than this.
+        0 disables the trigger
+        :param interval: sample interval of fully profiled iterations
+        :param slow_interval: sample interval used for the slow-iteration trigger
+        """
+        self.directory = directory
+        self.iterations = iterations
+        self.slow_threshold = slow_threshold
+        self.interval = interval
+        self.slow_interval = slow_interval
+        self.iteration = 0
+
+    def run(self, func, *args, **kwargs):
+        """Calls `func(*args, **kwargs)` as one iteration, profiling it when due"""
+        self.iteration += 1
+        full = self.iteration <= self.iterations
+        if not full and self.slow_threshold <= 0:
+            return func(*args, **kwargs)
+
+        profile = None
+        if full:
+            import cProfile
+            profile = cProfile.Profile()
+
+        sampler = StackSampler(self.interval if full else self.slow_interval)
+        sampler.start()
+        if profile:
+            profile.enable()
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration = perf_counter() - start
+            if profile:
+                profile.disable()
+            sampler.stop()
+
+            if full:
+                self._write(profile, sampler, duration, 'profile')
+            elif duration > self.slow_threshold:
+                log_msg('Iteration %d took %.1f seconds, over the %.1f seconds threshold' % (
+                    self.iteration, duration, self.slow_threshold))
+                self._write(None, sampler, duration, 'slow')
+
+    def _write(self, profile, sampler: StackSampler, duration: float, kind: str):
+        base = os.path.join(self.directory, 'moneriote-%s-%d-%s' % (
+            time.strftime('%Y%m%d-%H%M%S'), self.iteration, kind))
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            paths = [base + '.collapsed']
+            sampler.write(paths[0])
+            if profile:
+                paths.append(base + '.prof')
+                profile.dump_stats(paths[1])
+        except Exception as ex:
+            log_err('Writing the profile of iteration %d failed: %s' % (self.iteration, str(ex)))
+            return
+        log_msg('Profile of iteration %d (%.1f seconds) written to %s' % (
+            self.iteration, duration, ', '.join(paths)))
@@ -1,17 +1,22 @@
 from datetime import datetime
 import random
 import json
-
-from dateutil.parser import parse as dateutil_parse
+import ipaddress
+import time
+from collections import deque
+from functools import partial
 
 from moneriote import PATH_CACHE, CONFIG
 from moneriote.utils import log_msg, log_err, make_json_request
 
+# weight of the latest check in `RpcNode.latency_avg`
+LATENCY_EWMA_WEIGHT = 0.2
+
 
 class RpcNodeList:
     def __init__(self):
         self.nodes = []
-        self._addresses = []
+        self._addresses = set()
 
     @classmethod
     def from_list(cls, nodes):
@@ -23,7 +28,7 @@ class RpcNodeList:
     def append(self, node):
         if node.address not in self._addresses:
             self.nodes.append(node)
-            self._addresses.append(node.address)
+            self._addresses.add(node.address)
 
     def valid(self, valid=True):
         return RpcNodeList.from_list([
@@ -62,7 +67,9 @@ class RpcNodeList:
             if node.valid:
                 data.append({'address': node.address,
                              'port': node.port,
-                             'dt': node.dt})
+                             'dt': node.dt,
+                             'latency': node.latency,
+                             'latency_avg': node.latency_avg})
         try:
             f = open(PATH_CACHE, 'w')
             f.write(json.dumps(data, indent=4))
@@ -93,7 +100,6 @@ class RpcNodeList:
 
         nodes = RpcNodeList()
         for node in blob:
-            dt = dateutil_parse(node['dt'])
             if 'address' in node:
                 nodes.append(RpcNode(**node))
 
@@ -101,44 +107,193 @@ class RpcNodeList:
         return nodes
 
 
+def normalize_address(address: str):
+    """Returns IPv6 addresses in their compressed form, without brackets. Other addresses are returned as-is."""
+    address = address.strip()
+    if ':' not in address:
+        return address
+    try:
+        return ipaddress.ip_address(address.strip('[]')).compressed
+    except ValueError:
+        return address
+
+
 class RpcNode:
-    def __init__(self, address: str, uid=None, port=18089, dt= '', **kwargs):
+    def __init__(self, address: str, uid=None, port=None, dt= '', latency=None, latency_avg=None, **kwargs):
         """
-        :param address: ip
+        :param address: ipv4 or ipv6
+        :param port: RPC port, defaults to `CONFIG['rpc_port']`
         :param uid: record uid as per DNS provider
+        :param latency: seconds the last successful check took
+        :param latency_avg: exponentially weighted average of `latency` over the successful checks
         """
-        self.address = address
-        self.port = port
+        self.address = normalize_address(address)
+        self.port = port or CONFIG.get('rpc_port', 18089)
         self.uid = uid
-        self._acceptableBlockOffset = 3
+        # per-node probe timeout, set by `AdaptiveTimeout`
+        self.timeout = None
         self.valid = False
         self.dt = dt
+        self.latency = latency
+        self.latency_avg = latency_avg
+        self.failure = None
         self.kwargs = kwargs
 
+    @property
+    def is_ipv6(self):
+        return ':' in self.address
+
+    @property
+    def record_type(self):
+        return 'AAAA' if self.is_ipv6 else 'A'
+
+    @property
+    def netloc(self):
+        host = '[%s]' % self.address if self.is_ipv6 else self.address
+        return '%s:%d' % (host, self.port)
+
+    @property
+    def url(self):
+        return 'http://%s/' % self.netloc
+
     @staticmethod
-    def is_valid(current_blockheight, obj):
+    def is_valid(current_blockheight, obj, timeout: float = 2, block_offset: int = 3):
+        """
+        Scans the node to see if the RPC port is available and the node is within the accepted
+        range. Sets `valid`, `latency`, `latency_avg` and, when invalid, `failure`; one of 'refused',
+        'timeout', 'stale' or 'error'.
+        :param timeout: probe timeout, unless the node has its own `timeout`
+        :param block_offset: how many blocks the node may be behind
+        """
+        from requests.exceptions import Timeout, ConnectionError
+
         now = datetime.now()
-        # Scans the current node to see if the RPC port is available and is within the accepted range
-        url = 'http://%s:%d/' % (obj.address, obj.port)
-        url = '%s%s' % (url, 'getheight')
+        url = '%s%s' % (obj.url, 'getheight')
 
         if len(obj.dt) == 0:
             obj.dt = now.strftime('%Y-%m-%d %H:%M:%S')
 
+        obj.failure = None
         try:
-            blob = make_json_request(url, verbose=False, timeout=2)
+            start = time.monotonic()
+            blob = make_json_request(url, verbose=False, raise_errors=True, timeout=obj.timeout or timeout)
             if not blob:
                 raise Exception()
+            obj.latency = time.monotonic() - start
+            if obj.latency_avg is None:
+                obj.latency_avg = obj.latency
+            else:
+                obj.latency_avg += (obj.latency - obj.latency_avg) * LATENCY_EWMA_WEIGHT
+        except Timeout:
+            obj.failure = 'timeout'
+            return obj
+        except ConnectionError:
+            obj.failure = 'refused'
+            return obj
         except Exception as ex:
+            obj.failure = 'error'
             return obj
 
         if not isinstance(blob.get('height', ''), int):
+            obj.failure = 'error'
             return obj
 
         height = blob.get('height')
         diff = current_blockheight - height
 
         # Check if the node we're checking is up to date (with a little buffer)
-        if diff <= obj._acceptableBlockOffset:
+        if diff <= block_offset:
             obj.valid = True
+        else:
+            obj.failure = 'stale'
         return obj
+
+
+class AdaptiveTimeout:
+    """
+    Learns the probe timeout from the latencies of valid nodes; a percentile of
+    the observed latencies plus a margin, within [minimum, maximum]. Nodes with a
+    known latency get at least their own latency plus the margin.
+    """
+    def __init__(self, maximum: float, minimum: float = 0.25, percentile: float = 95, margin: float = 0.5,
+                 window: int = 1000, min_samples: int = 20):
+        """
+        :param maximum: timeout used until `min_samples` latencies were observed, and the upper bound
+        :param margin: fraction added on top of the percentile, 0.5 is +50%
+        """
+        self.maximum = maximum
+        self.minimum = minimum
+        self.percentile = percentile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.samples = deque(maxlen=window)
+
+    def observe(self, latency: float):
+        self.samples.append(latency)
+
+    def _clamp(self, value: float):
+        return max(self.minimum, min(self.maximum, value))
+
+    @property
+    def timeout(self):
+        if len(self.samples) < self.min_samples:
+            return self.maximum
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return self._clamp(ordered[index] * (1 + self.margin))
+
+    def for_node(self, node: RpcNode):
+        timeout = self.timeout
+        if node.latency:
+            timeout = max(timeout, self._clamp(node.latency * (1 + self.margin)))
+        return timeout
+
+
+def iter_scan(nodes, blockchain_height: int, processes: int, adaptive: AdaptiveTimeout = None,
+              prefilter: bool = True):
+    """
+    Checks `nodes` using a pool of `processes` workers. With `CONFIG['tcp_prefilter']`
+    set, only nodes accepting a TCP connection on their RPC port are checked over HTTP.
+    :param adaptive: when given, sets per-node timeouts and learns from the results
+    :param prefilter: False skips the TCP pre-filter, e.g. for known nodes
+    :return: generator yielding every node, with `valid` set, as soon as its check completes
+    """
+    from multiprocessing import Pool
+
+    rejected = deque()
+    if prefilter and CONFIG.get('tcp_prefilter'):
+        from moneriote.prefilter import iter_open
+        # by default the connect may take as long as the probe would allow, so the
+        # pre-filter never rejects a node the HTTP check would have accepted
+        tcp_timeout = CONFIG.get('tcp_timeout') or (adaptive.timeout if adaptive else CONFIG.get('probe_timeout', 2))
+        nodes = iter_open(nodes, rejected,
+                          timeout=tcp_timeout,
+                          max_in_flight=CONFIG.get('tcp_max_in_flight', 500))
+
+    if adaptive:
+        nodes = _with_timeout(nodes, adaptive)
+
+    # passed explicitly, the pool processes may not share CONFIG
+    check = partial(RpcNode.is_valid, blockchain_height,
+                    timeout=CONFIG.get('probe_timeout', 2),
+                    block_offset=CONFIG.get('block_offset', 3))
+
+    pool = Pool(processes=processes)
+    try:
+        for node in pool.imap_unordered(check, nodes):
+            if adaptive and node.valid:
+                adaptive.observe(node.latency)
+            yield node
+            while rejected:
+                yield rejected.popleft()
+        while rejected:
+            yield rejected.popleft()
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _with_timeout(nodes, adaptive: AdaptiveTimeout):
+    for node in nodes:
+        node.timeout = adaptive.for_node(node)
+        yield node
@@ -0,0 +1,59 @@
+"""
+Record selection strategies; which valid nodes to publish.
+
+`random` publishes a fresh random subset every iteration. `stable` keeps the
+published nodes as long as they stay valid and are not clearly slower than the
+best unpublished node, so DNS records only change when needed. Nodes are
+compared on their averaged latency; single checks jitter too much.
+"""
+import random
+
+
+def _score(node):
+    # lower is better; nodes without a measured latency go last
+    latency = node.latency_avg if node.latency_avg is not None else node.latency
+    return latency if latency is not None else float('inf')
+
+
+def select_random(candidates: list, limit: int):
+    candidates = list(candidates)
+    random.shuffle(candidates)
+    return candidates[:limit]
+
+
+def select_stable(published: list, candidates: list, limit: int, max_rotations: int = 1,
+                  rotation_factor: float = 2.0, rotation_min_gap: float = 0.1):
+    """
+    :param published: nodes currently in DNS
+    :param candidates: valid nodes
+    :param limit: amount of nodes to publish
+    :param max_rotations: maximum amount of healthy published nodes to replace by faster ones
+    :param rotation_factor: a published node is replaced when its latency is this many times
+    that of the fastest unpublished node
+    :param rotation_min_gap: seconds by which that latency must exceed the fastest unpublished
+    node's as well, so jitter between similarly fast nodes does not cause rotations
+    :return: nodes to publish
+    """
+    by_address = {node.address: node for node in candidates}
+
+    # keep published nodes that are still valid, fastest first in case `limit` was lowered
+    kept = sorted([by_address[node.address] for node in published if node.address in by_address], key=_score)
+    kept = kept[:limit]
+    kept_addresses = {node.address for node in kept}
+    spare = sorted([node for node in candidates if node.address not in kept_addresses], key=_score)
+
+    # replace failed records; these do not count as rotations
+    while len(kept) < limit and spare:
+        kept.append(spare.pop(0))
+
+    rotations = 0
+    while rotations < max_rotations and spare and kept:
+        worst = max(kept, key=_score)
+        if _score(worst) <= _score(spare[0]) * rotation_factor or \
+                _score(worst) - _score(spare[0]) < rotation_min_gap:
+            break
+        kept.remove(worst)
+        kept.append(spare.pop(0))
+        rotations += 1
+
+    return kept
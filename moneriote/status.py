@@ -0,0 +1,165 @@
+"""
+Node statistics and scan state for the status API (`moneriote.status_api`).
+
+The scanner publishes into a `StatusStore`, which keeps immutable snapshots.
+Requests only read the latest snapshot, so queries never block the scanner.
+"""
+import time
+
+from moneriote.rpc import RpcNode
+
+SORT_KEYS = ('address', 'latency', 'uptime', 'last_checked')
+
+
+class StatusStore:
+    """
+    Node statistics and scan state. Updated from the scanner thread only; every update
+    replaces the published snapshots, which are never modified afterwards.
+    """
+    def __init__(self, retention: float = 5400):
+        """:param retention: seconds to keep nodes in the inventory that were not checked since"""
+        self.started = time.time()
+        self.retention = retention
+        # address -> node stats; replaced, never modified, once published
+        self._stats = {}
+        # addresses of `_stats` in the order of the inventory
+        self._order = []
+        self._progress = None
+
+        self.inventory = []
+        self.state = {
+            'started': self.started,
+            'phase': 'starting',
+            'height': None,
+            'scan': None,
+            'last_scan': None,
+            'last_iteration': None,
+            'records': [],
+            'next': {}
+        }
+
+    def _publish(self, **changes):
+        state = dict(self.state)
+        state.update(changes)
+        self.state = state
+
+    def set_phase(self, phase: str, **changes):
+        self._publish(phase=phase, **changes)
+
+    def scan_started(self, phase: str):
+        self._progress = {'phase': phase, 'started': time.time(), 'checked': 0, 'valid': 0}
+        self._publish(phase=phase, scan=dict(self._progress))
+
+    def track(self, nodes):
+        """Passes through the results of a scan, publishing the progress as they come in"""
+        for node in nodes:
+            if self._progress is not None:
+                self._progress['checked'] += 1
+                self._progress['valid'] += 1 if node.valid else 0
+                self._publish(scan=dict(self._progress))
+            yield node
+
+    def scan_finished(self, nodes, skipped: int = 0, banned: int = 0):
+        """Folds the results of a scan into the node statistics and republishes the inventory"""
+        now = time.time()
+        added = False
+        observed = 0
+        for node in nodes:
+            added |= self._observe(node, now)
+            observed += 1
+
+        # dead peers are only checked by mass-scans; forget those not seen for a while
+        expired = [address for address, stats in self._stats.items() if stats['last_checked'] < now - self.retention]
+        for address in expired:
+            del self._stats[address]
+
+        if added or expired:
+            self._order = sorted(self._stats)
+        if observed or expired:
+            self.inventory = [self._stats[address] for address in self._order]
+
+        last_scan = dict(self._progress or {'phase': None, 'started': now, 'checked': 0, 'valid': 0})
+        last_scan.update(finished=now, duration=now - last_scan['started'], skipped=skipped, banned=banned)
+        self._progress = None
+        self._publish(scan=None, last_scan=last_scan, nodes=len(self.inventory))
+
+    def _observe(self, node: RpcNode, now: float):
+        """:return: True when `node` is new to the inventory"""
+        stats = self._stats.get(node.address)
+        added = stats is None
+        if added:
+            stats = {
+                'address': node.address,
+                'type': node.record_type,
+                'first_checked': now,
+                'checks': 0,
+                'successes': 0,
+                'latency': None,
+                'latency_avg': None,
+                'last_valid': None
+            }
+        else:
+            # the published inventory may still hold the previous dict
+            stats = dict(stats)
+        self._stats[node.address] = stats
+
+        stats['port'] = node.port
+        stats['checks'] += 1
+        stats['last_checked'] = now
+        stats['valid'] = node.valid
+        stats['failure'] = node.failure
+        if node.valid:
+            stats['successes'] += 1
+            stats['last_valid'] = now
+            if node.latency is not None:
+                stats['latency'] = node.latency
+                # exponentially weighted, recent checks count most
+                avg = stats['latency_avg']
+                stats['latency_avg'] = node.latency if avg is None else avg * 0.8 + node.latency * 0.2
+        stats['uptime'] = stats['successes'] / stats['checks']
+        return added
+
+    def iteration_finished(self, summary: dict, next_iteration: float = None, next_mass_scan: float = None):
+        records = self.state['records']
+        dns = summary.get('dns')
+        if dns:
+            records = dns['chosen'] if dns['applied'] else dns['current']
+
+        last_iteration = {key: summary.get(key) for key in ('mode', 'started', 'timings', 'valid', 'error')}
+        self._publish(phase='idle',
+                      height=summary.get('height') or self.state['height'],
+                      records=list(records),
+                      last_iteration=last_iteration,
+                      next={'iteration': next_iteration, 'mass_scan': next_mass_scan})
+
+    def query(self, valid: bool = None, record_type: str = None, failure: str = None, max_latency: float = None,
+              min_uptime: float = None, sort: str = 'address', reverse: bool = False, offset: int = 0,
+              limit: int = 100):
+        """
+        Filters and pages the current inventory snapshot.
+        :return: dict with the `total` amount of matching nodes and the requested page of them
+        """
+        nodes = self.inventory
+        if valid is not None:
+            nodes = [node for node in nodes if node['valid'] == valid]
+        if record_type:
+            nodes = [node for node in nodes if node['type'] == record_type.upper()]
+        if failure:
+            nodes = [node for node in nodes if node['failure'] == failure]
+        if max_latency is not None:
+            nodes = [node for node in nodes if node['latency'] is not None and node['latency'] <= max_latency]
+        if min_uptime is not None:
+            nodes = [node for node in nodes if node['uptime'] >= min_uptime]
+
+        if sort != 'address' or reverse:
+            # nodes without a value (no latency yet) go last either way
+            nodes = sorted((node for node in nodes if node[sort] is not None),
+                           key=lambda node: node[sort], reverse=reverse) + \
+                [node for node in nodes if node[sort] is None]
+
+        return {
+            'total': len(nodes),
+            'offset': offset,
+            'limit': limit,
+            'nodes': nodes[offset:offset + limit]
+        }
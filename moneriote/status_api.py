@@ -0,0 +1,105 @@
+"""
+Status API; an optional HTTP server (`--status-address 127.0.0.1:18200`)
+serving the node inventory, the published records and the scan state of a
+`StatusStore` as JSON. Imported only when enabled.
+
+    GET /status   scan state, published records and next scheduled actions
+    GET /records  the published records
+    GET /nodes    the node inventory; filters `valid`, `type`, `failure`,
+                  `max_latency`, `min_uptime`, ordering `sort` and paging
+                  `offset`, `limit`
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+from moneriote.status import SORT_KEYS, StatusStore
+from moneriote.utils import log_msg
+
+
+def _parse_bool(value: str):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError("bad boolean \'%s\'" % value)
+
+
+def _parse_query(query: str):
+    """Parses the `/nodes` query string into `StatusStore.query` arguments; raises ValueError"""
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    kwargs = {
+        'offset': max(0, int(params.pop('offset', 0))),
+        'limit': max(0, min(1000, int(params.pop('limit', 100))))
+    }
+    if 'valid' in params:
+        kwargs['valid'] = _parse_bool(params.pop('valid'))
+    if 'type' in params:
+        kwargs['record_type'] = params.pop('type')
+    if 'failure' in params:
+        kwargs['failure'] = params.pop('failure')
+    if 'max_latency' in params:
+        kwargs['max_latency'] = float(params.pop('max_latency'))
+    if 'min_uptime' in params:
+        kwargs['min_uptime'] = float(params.pop('min_uptime'))
+    if 'sort' in params:
+        sort = params.pop('sort')
+        kwargs['reverse'] = sort.startswith('-')
+        kwargs['sort'] = sort.lstrip('-')
+        if kwargs['sort'] not in SORT_KEYS:
+            raise ValueError("bad sort key \'%s\'" % kwargs['sort'])
+    if params:
+        raise ValueError('unknown parameter(s) %s' % ', '.join(sorted(params)))
+    return kwargs
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        store = self.server.store
+        url = urlparse(self.path)
+
+        if url.path == '/status':
+            self._send_json(store.state)
+        elif url.path == '/records':
+            self._send_json({'records': store.state['records']})
+        elif url.path == '/nodes':
+            try:
+                kwargs = _parse_query(url.query)
+            except ValueError as ex:
+                self.send_error(400, str(ex))
+                return
+            self._send_json(store.query(**kwargs))
+        else:
+            self.send_error(404)
+
+    def _send_json(self, data):
+        body = json.dumps(data, sort_keys=True).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StatusServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, store: StatusStore):
+        super().__init__(address, StatusHandler)
+        self.store = store
+
+
+def start_status_server(address: str, store: StatusStore):
+    """Serves `store` on 'host:port' from a background thread"""
+    from moneriote.distributed import parse_address
+
+    server = StatusServer(parse_address(address), store)
+    thread = threading.Thread(target=server.serve_forever, name='status-server', daemon=True)
+    thread.start()
+    log_msg('Status API listening on %s' % address)
+    return server
@@ -1,13 +1,39 @@
 import os
+import atexit
 import configparser
+import json
+import logging
+import logging.handlers
+import queue
 import sys
 import random
-from datetime import datetime
+from datetime import datetime, timezone
 
-import requests
+logger = logging.getLogger('moneriote')
+_log_listener = None
 
 
-def banner():
+class RateLimitError(Exception):
+    """Raised on HTTP 429; `retry_after` holds the seconds to wait, when the server said so"""
+    def __init__(self, url, retry_after=None):
+        super(RateLimitError, self).__init__('Rate limited (%s)' % url)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """:return: seconds to wait according to a Retry-After header value, or None"""
+    if not value:
+        return
+    if value.strip().isdigit():
+        return int(value)
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return
+
+
+def banner(stream=None):
     header = """
   \033[92m• ▌ ▄ ·.        ▐ ▄ ▄▄▄ .▄▄▄  ▪        ▄▄▄▄▄▄▄▄ .
   ·██ ▐███▪▪     •█▌▐█▀▄.▀·▀▄ █·██ ▪     •██  ▀▄.▀·
@@ -18,20 +44,81 @@ def banner():
     @skftn @Lafudoci @gingeropolous @connorw600
  \033[0m
     """.strip()
-    print(header)
+    print(header, file=stream or sys.stdout)
+
+
+class ColorFormatter(logging.Formatter):
+    def format(self, record):
+        color = '\033[91m' if record.levelno >= logging.WARNING else '\033[92m'
+        return '%s[%s]\033[0m %s' % (color, self.formatTime(record, "%Y-%m-%d %H:%M"), record.getMessage())
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({
+            'time': datetime.fromtimestamp(record.created).isoformat(),
+            'level': record.levelname.lower(),
+            'msg': record.getMessage()
+        })
+
+
+def setup_logging(level: str = 'info', json_output: bool = False, stream=None):
+    """
+    Routes the 'moneriote' logger through a queue; records are formatted and written by a
+    background thread so logging never blocks the caller on stdout.
+    :param level: 'debug', 'info', 'warning' or 'error'
+    :param json_output: write JSON lines instead of coloured text
+    :param stream: where to write to, stdout by default
+    """
+    global _log_listener
+    if _log_listener:
+        _log_listener.stop()
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if json_output else ColorFormatter())
+
+    log_queue = queue.Queue(-1)
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.propagate = False
+    logger.setLevel(level.upper())
+
+    _log_listener = logging.handlers.QueueListener(log_queue, handler)
+    _log_listener.start()
+
+
+def stop_logging():
+    """Flushes pending log records"""
+    global _log_listener
+    if _log_listener:
+        _log_listener.stop()
+        _log_listener = None
+
+
+atexit.register(stop_logging)
+
+
+def _ensure_logging():
+    if not logger.handlers:
+        setup_logging()
 
 
 def log_err(msg, fatal=False):
-    now = datetime.now()
-    print('\033[91m[%s]\033[0m %s' % (now.strftime("%Y-%m-%d %H:%M"), msg))
+    _ensure_logging()
+    logger.error(msg)
 
     if fatal:
+        stop_logging()
         sys.exit()
 
 
 def log_msg(msg):
-    now = datetime.now()
-    print('\033[92m[%s]\033[0m %s' % (now.strftime("%Y-%m-%d %H:%M"), msg))
+    _ensure_logging()
+    logger.info(msg)
+
+
+def log_debug(msg):
+    _ensure_logging()
+    logger.debug(msg)
 
 
 def random_user_agent():
@@ -47,7 +134,7 @@ def random_user_agent():
     ])
 
 
-def make_json_request(url, headers=None, method='GET', verbose=True, **kwargs):
+def make_json_request(url, headers=None, method='GET', verbose=True, raise_errors=False, **kwargs):
     if verbose:
         log_msg("%s: %s" % (method, url))
 
@@ -60,6 +147,8 @@ def make_json_request(url, headers=None, method='GET', verbose=True, **kwargs):
     if headers:
         kwargs['headers'] = headers
 
+    import requests
+
     try:
         _method = getattr(requests, method.lower())
         if not _method:
@@ -71,11 +160,17 @@ def make_json_request(url, headers=None, method='GET', verbose=True, **kwargs):
 
     try:
         resp = _method(url=url, **kwargs)
+        if resp.status_code == 429:
+            raise RateLimitError(url, parse_retry_after(resp.headers.get('Retry-After')))
         resp.raise_for_status()
         return resp.json()
+    except RateLimitError:
+        raise
     except Exception as ex:
         if verbose:
             log_err("Error (%s): %s" % (url, str(ex)))
+        if raise_errors:
+            raise
 
 
 def parse_ini(fn):
@@ -89,13 +184,14 @@ def parse_ini(fn):
         if val.isdigit():
             return int(val)
         if val.lower() in ['true', 'false']:
-            return bool(val)
+            return val.lower() == 'true'
         return val
 
     md = {k: try_cast(v) for k, v in config._sections.get('MoneroDaemon', {}).items()}
     dns = {k: try_cast(v) for k, v in config._sections.get('DNS', {}).items()}
     ban = {k: try_cast(v) for k, v in config._sections.get('BanList', {}).items()}
-    return md, dns, ban
+    scan = {k: try_cast(v) for k, v in config._sections.get('Scan', {}).items()}
+    return md, dns, ban, scan
 
 
 def parse_ban_list(path):
@@ -27,8 +27,7 @@ setup(
     url='',
     install_requires=[
         'requests',
-        'click',
-        'python-dateutil'
+        'click'
     ],
     entry_points='''
     [console_scripts]